@@ -8,6 +8,10 @@ import warnings
 from PIL import Image
 import time
 import base64
+import uuid
+import os
+import shutil
+import tempfile
 
 ######################
 # Page Config
@@ -20,6 +24,8 @@ st.markdown(f"<style>{custom_functions.local_css('style/style.css')}</style>", u
 # Initialize variables
 ######################
 filter_form_submitted = False
+if 'session_id' not in st.session_state:
+    st.session_state['session_id'] = uuid.uuid4().hex # used for the per session memory budget of parsed frames
 uploaded_file_valid = False
 warnings.simplefilter("ignore") # Ignore openpyxl Excile File Warning while reading (no default style)
 
@@ -29,7 +35,9 @@ warnings.simplefilter("ignore") # Ignore openpyxl Excile File Warning while read
 header_section = st.container() # Description of page & what it is about
 upload_filter_section = st.container() # File Upload & Filter section
 analysis_section = st.container() # Analysis section - either error message if wrong excel file or analysis content
+history_section = st.container() # Capacity history & growth forecast section
 sizing_section = st.container() # Sizing section
+report_section = st.container() # Report export section
 
 ######################
 # Page content
@@ -46,16 +54,60 @@ with upload_filter_section:
             
     with column_upload:
         uploaded_file = st.file_uploader(label="Laden Sie Ihre Excel basierte RVTools Auswertung (> v4.1.2) hier hoch.", type=['xlsx'], help='Diesen Excel Export können Sie direkt aus RVTools als Excel Datei exportieren.')
+        progressive_mode = st.checkbox('Schnellvorschau: vorläufige Ergebnisse anzeigen, während die Auswertung eingelesen wird (Tabs werden nacheinander eingelesen)', value=False)
+        derive_mode = st.checkbox('vCPU / vMemory aus vInfo ableiten (vCPU & vMemory Tabs werden nicht eingelesen)', value=custom_functions.derive_vCPU_vMemory_from_vInfo)
 
     if uploaded_file is not None:
         with column_filter:            
+                preview_placeholder = analysis_section.empty() # preliminary results in progressive mode
                 try:
                     # Store excel shortterm in AWS for debugging purposes
                     #if uploaded_file.name not in st.session_state:
                     #    custom_functions.upload_to_aws(uploaded_file)
 
-                    # load excel, filter our relevant tabs and columns, merge all in one dataframe
-                    df_vInfo, df_vCPU, df_vMemory, df_vDisk, df_vPartition, df_vHosts, df_vDataStore = custom_functions.get_data_from_excel(uploaded_file)            
+                    # load excel (spooled & memory mapped, validated before the full parse), filter our relevant tabs and columns, merge all in one dataframe
+                    # parse runs in a shared worker pool, show queue position / progress while waiting
+                    parse_status = st.empty()
+                    def show_parse_status(queue_position, elapsed_seconds):
+                        if queue_position > 0:
+                            parse_status.info(f"Die RVTools Auswertung steht in der Warteschlange an Position {queue_position} ({int(elapsed_seconds)} s).")
+                        else:
+                            parse_status.info(f"Die RVTools Auswertung wird eingelesen ... ({int(elapsed_seconds)} s)")
+                    # progressive mode: show preliminary results (all clusters) for each parsed stage until every figure is final
+                    def show_parse_preview(parsed_sheets):
+                        with preview_placeholder.container():
+                            st.markdown("---")
+                            st.markdown("### Auswertung <span style='color:#F36D21;'>(vorläufig)</span>", unsafe_allow_html=True)
+                            st.warning('Vorläufige Ergebnisse über alle Cluster - die Auswertung wird noch eingelesen. vStorage Auswertung und Sizing folgen, sobald alle Tabs eingelesen sind.')
+                            if 'vInfo' in parsed_sheets:
+                                preview_vInfo = parsed_sheets['vInfo']
+                                st.markdown(f"<h4 style='text-align: center;'>Vorläufig: <b>{ preview_vInfo['Datacenter'].nunique() } Datacenter</b>, <b>{ preview_vInfo['Cluster'].nunique() } Cluster</b>, <b>{ preview_vInfo['Host'].nunique() } Host</b>, <b>{ preview_vInfo.shape[0] } VMs</b>, <b>{ int(preview_vInfo['CPUs'].sum()) } vCPUs</b> und <b>{ round(preview_vInfo['Memory'].sum()/1024,2) } GiB vMemory</b>.</h4>", unsafe_allow_html=True)
+                            if 'vHost' in parsed_sheets:
+                                preview_vHosts = parsed_sheets['vHost']
+                                preview_column_cpu, preview_column_memory = st.columns(2)
+                                with preview_column_cpu:
+                                    st.markdown("<h4 style='text-align: center; color:#034ea2;'>pCPU (vorläufig):</h4>", unsafe_allow_html=True)
+                                    preview_total_ghz, preview_consumed_ghz, preview_cpu_percentage = custom_functions.generate_CPU_infos(preview_vHosts)
+                                    preview_cpu_donut_chart, preview_cpu_donut_chart_config = custom_functions.generate_donut_charts(preview_cpu_percentage)
+                                    st.plotly_chart(preview_cpu_donut_chart, use_container_width=True, config=preview_cpu_donut_chart_config)
+                                    st.markdown(f"<p style='text-align: center;'>{preview_consumed_ghz} GHz von {preview_total_ghz} GHz verwendet</p>", unsafe_allow_html=True)
+                                with preview_column_memory:
+                                    st.markdown("<h4 style='text-align: center; color:#034ea2;'>pMemory (vorläufig):</h4>", unsafe_allow_html=True)
+                                    preview_total_memory, preview_consumed_memory, preview_memory_percentage = custom_functions.generate_Memory_infos(preview_vHosts)
+                                    preview_memory_donut_chart, preview_memory_donut_chart_config = custom_functions.generate_donut_charts(preview_memory_percentage)
+                                    st.plotly_chart(preview_memory_donut_chart, use_container_width=True, config=preview_memory_donut_chart_config)
+                                    st.markdown(f"<p style='text-align: center;'>{preview_consumed_memory} GiB von {preview_total_memory} GiB verwendet</p>", unsafe_allow_html=True)
+                            if 'vCPU' in parsed_sheets and 'vMemory' in parsed_sheets and 'vHost' in parsed_sheets:
+                                preview_column_vCPU, preview_column_vRAM = st.columns(2)
+                                with preview_column_vCPU:
+                                    st.markdown("<h5 style='text-align: left; color:#034ea2; '><u>vCPU Auswertung (vorläufig)</u></h5>", unsafe_allow_html=True)
+                                    st.table(custom_functions.generate_vCPU_overview_df(parsed_sheets['vCPU'], parsed_sheets['vHost']))
+                                with preview_column_vRAM:
+                                    st.markdown("<h5 style='text-align: left; color:#034ea2; '><u>vMemory Auswertung (vorläufig)</u></h5>", unsafe_allow_html=True)
+                                    st.table(custom_functions.generate_vRAM_overview_df(parsed_sheets['vMemory']))
+                    df_vInfo, df_vCPU, df_vMemory, df_vDisk, df_vPartition, df_vHosts, df_vDataStore = custom_functions.load_analysis_frames(uploaded_file, st.session_state['session_id'], show_parse_status, show_parse_preview, progressive_mode, derive_mode)
+                    parse_status.empty()
+                    preview_placeholder.empty()
 
                     vCluster_selected = st.multiselect(
                         "vCluster selektieren:",
@@ -70,25 +122,38 @@ with upload_filter_section:
                     uploaded_file_valid = True
                     st.success("Die RVTools Auswertung wurde erfolgreich hochgeladen. Filtern Sie bei Bedarf nach einzelnen Clustern.")
                     
+                except custom_functions.RVToolsValidationError as e:
+                    preview_placeholder.empty()
+                    uploaded_file_valid = False
+                    analysis_section.error("##### FEHLER: Die hochgeladene RVTools Excel Datei ist unvollständig. Stellen Sie bitte sicher, dass mindestens RVTools in der Version v4.1.2 (05.04.2021) oder neuer zum Einsatz kommt und die Excel Datei nicht manuell editiert wurde.")
+                    analysis_section.markdown(str(e))
+                    st.session_state[uploaded_file.name] = True
+
+                except custom_functions.ParseQueueFullError:
+                    preview_placeholder.empty()
+                    uploaded_file_valid = False
+                    analysis_section.warning("##### Aktuell werden zu viele RVTools Auswertungen gleichzeitig eingelesen. Bitte versuchen Sie es in wenigen Minuten erneut.")
+
                 except Exception as e:
+                    preview_placeholder.empty()
                     uploaded_file_valid = False                    
                     analysis_section.error("##### FEHLER: Die hochgeladene RVTools Excel Datei konnte leider nicht ausgelesen werden. Stellen Sie bitte sicher, dass mindestens RVTools in der Version v4.1.2 (05.04.2021) oder neuer zum Einsatz kommt und die Excel Datei nicht manuell editiert wurde.")
                     analysis_section.markdown("Für eine Auslesen werden folgende Tabs & Spalten benöotigt:")
                     analysis_section.markdown("""
                         * ***vInfo***
                             * VM, Powerstate, CPUs, Memory, Provisioned MiB, In Use MiB, Datacenter, Cluster, Host, OS according to the configuration file, OS according to the VMware Tools, VM ID
-                        * ***vCPU***
+                        * ***vCPU*** (nicht benötigt, wenn vCPU / vMemory aus vInfo abgeleitet werden)
                             * VM, Powerstate, CPUs, Cluster, VM ID
-                        * ***vMemory***
+                        * ***vMemory*** (nicht benötigt, wenn vCPU / vMemory aus vInfo abgeleitet werden)
                             * VM, Powerstate, Size MiB, Cluster, VM ID
                         * ***vDisk***
                             * Powerstate, Capacity MiB, Thin, Cluster, VM ID
                         * ***vPartition***
                             * Powerstate, Capacity MiB, Consumed MiB, Cluster, VM ID
                         * ***vHosts***
-                            * Cluster, Speed, # CPU, Cores per CPU, # Cores, CPU usage %, # Memory, Memory usage %, # VMs
+                            * Host, Cluster, Speed, # CPU, Cores per CPU, # Cores, CPU usage %, # Memory, Memory usage %, # VMs
                         * ***vDatastore***
-                            *  Capacity MiB, Provisioned MiB, In Use MiB, Object ID
+                            *  Capacity MiB, Provisioned MiB, In Use MiB, Object ID (optional: Hosts für einen Filter auf Cluster Ebene)
                         """)
                     analysis_section.markdown("---")
                     analysis_section.markdown("Im folgenden die genaue Fehlermeldung für ein Troubleshooting:")
@@ -109,7 +174,14 @@ if uploaded_file is not None and uploaded_file_valid is True and len(vCluster_se
         df_vMemory_filtered = df_vMemory.query("`Cluster`==@vCluster_selected")    
         df_vDisk_filtered = df_vDisk.query("`Cluster`==@vCluster_selected") 
         df_vPartition_filtered = df_vPartition.query("`Cluster`==@vCluster_selected")
-        #vDatastore has no filled cluster name therefore no filter on Cluster level possible
+        # vDatastore has no filled cluster name therefore filter via datastore hosts -> cluster index (if vDatastore "Hosts" is available)
+        datastore_cluster_index = custom_functions.generate_datastore_cluster_index(df_vHosts, df_vInfo, df_vDataStore)
+        df_vDataStore_filtered = custom_functions.filter_datastores_by_cluster(df_vDataStore, datastore_cluster_index, vCluster_selected)
+
+        # Distribution charts are binned once per upload and only summed up for the cluster selection
+        vCPU_histogram_index = custom_functions.generate_histogram_index(df_vCPU, 'CPUs')
+        vMemory_histogram_index = custom_functions.generate_histogram_index(df_vMemory, 'Size MiB')
+        vDisk_histogram_index = custom_functions.generate_histogram_index(df_vDisk, 'Capacity MiB', bins=custom_functions.vDisk_histogram_bins, value_divisor=1024)
 
         vCluster_expander = st.expander(label='vCluster Übersicht')
         with vCluster_expander:
@@ -134,7 +206,7 @@ if uploaded_file is not None and uploaded_file_valid is True and len(vCluster_se
 
             with column_storage:
                 st.markdown("<h4 style='text-align: center; color:#034ea2;'>vDatastore:</h4>", unsafe_allow_html=True)
-                storage_provisioned, storage_consumed, storage_percentage = custom_functions.generate_Storage_infos(df_vDataStore)
+                storage_provisioned, storage_consumed, storage_percentage = custom_functions.generate_Storage_infos(df_vDataStore_filtered)
                 vDatastore_donut_chart, vDatastore_donut_chart_config = custom_functions.generate_donut_charts(storage_percentage)
                 st.plotly_chart(vDatastore_donut_chart, use_container_width=True, config=vDatastore_donut_chart_config)
                 st.markdown(f"<p style='text-align: center;'>{storage_consumed} TiB verwendet</p>", unsafe_allow_html=True)
@@ -184,8 +256,8 @@ if uploaded_file is not None and uploaded_file_valid is True and len(vCluster_se
 
             with column_top10_vCPU:        
                 st.markdown(f"<h6 style='text-align: center; color:#000000;'>Top 10 VMs: vCPU (On)</h6>", unsafe_allow_html=True)     
-                top_vms_vMemory = custom_functions.generate_top10_vCPU_VMs_df(df_vInfo_filtered_vm_on)
-                st.table(top_vms_vMemory)
+                top_vms_vCPU = custom_functions.generate_top10_vCPU_VMs_df(df_vInfo_filtered_vm_on)
+                st.table(top_vms_vCPU)
             with column_top10_vRAM:
                 st.markdown(f"<h6 style='text-align: center; color:#000000;'>Top 10 VMs: vMemory (On)</h6>", unsafe_allow_html=True)
                 top_vms_vMemory = custom_functions.generate_top10_vMemory_VMs_df(df_vInfo_filtered_vm_on)
@@ -197,19 +269,26 @@ if uploaded_file is not None and uploaded_file_valid is True and len(vCluster_se
 
         guest_os_expander = st.expander(label='VM Gastbetriebssystem Details')
         with guest_os_expander:
-            guest_os_df_config, guest_os_df_tools = custom_functions.generate_guest_os_df(df_vInfo_filtered)
+            guest_os_classification = custom_functions.generate_guest_os_classification(df_vInfo) # once per upload, filtered rows are selected
+            guest_os_df_config, guest_os_df_tools = custom_functions.generate_guest_os_df(df_vInfo_filtered, guest_os_classification)
 
             column_guestos_1, column_guestos_2 = st.columns(2)
             with column_guestos_1:
                 st.markdown(f"<h5 style='text-align: center; color:#034ea2;'>Gastbetriebssysteme nach Configurations-File:</h5>", unsafe_allow_html=True)
                 st.table(guest_os_df_config)
-                st.markdown(f"<u>Gesamtanzahl VMs mit Guest OS nach Configurations-File:</u> <b>{guest_os_df_config['Guest OS'].sum()}</b>", unsafe_allow_html=True)
+                st.markdown(f"<u>Gesamtanzahl VMs mit Guest OS nach Configurations-File:</u> <b>{guest_os_df_config['Anzahl VMs'].sum()}</b>", unsafe_allow_html=True)
             with column_guestos_2:
                 st.markdown(f"<h5 style='text-align: center; color:#034ea2;'>Gastbetriebssysteme nach VMware Tools:</h5>", unsafe_allow_html=True)        
                 st.table(guest_os_df_tools)
-                st.markdown(f"<u>Gesamtanzahl VMs mit Guest OS nach VMware Tools:</u> <b>{guest_os_df_tools['Guest OS'].sum()}</b>", unsafe_allow_html=True)
+                st.markdown(f"<u>Gesamtanzahl VMs mit Guest OS nach VMware Tools:</u> <b>{guest_os_df_tools['Anzahl VMs'].sum()}</b>", unsafe_allow_html=True)
 
-            st.write('Ein Auslesen der Gastbetriebssysteme basiert entweder auf der Konfigurationsdatei oder auf einer Auswertung der installierten VMware Tools. Ein Auslesen durch die VMware Tools ist zwar genauer, setzt aber vorraus dass passende VMware Tools installiert sind was i.d.R. nicht überall der Fall ist, daher wurde hier beides aufgelistet.')
+            st.write('Ein Auslesen der Gastbetriebssysteme basiert entweder auf der Konfigurationsdatei oder auf einer Auswertung der installierten VMware Tools. Ein Auslesen durch die VMware Tools ist zwar genauer, setzt aber vorraus dass passende VMware Tools installiert sind was i.d.R. nicht überall der Fall ist, daher wurde hier beides aufgelistet. Die Gastbetriebssysteme sind nach Familie, Version und Lizenzierung zusammengefasst.')
+
+            st.markdown(f"<h5 style='text-align: left; color:#034ea2;'>Abweichungen Configurations-File / VMware Tools:</h5>", unsafe_allow_html=True)
+            guest_os_mismatch_df = custom_functions.generate_guest_os_mismatch_df(df_vInfo_filtered, guest_os_classification)
+            if guest_os_mismatch_df.shape[0] > 0:
+                st.dataframe(guest_os_mismatch_df)
+            st.markdown(f"<u>Anzahl VMs mit abweichendem Gastbetriebssystem:</u> <b>{guest_os_mismatch_df.shape[0]}</b>", unsafe_allow_html=True)
 
         vCPU_expander = st.expander(label='vCPU Details')
         with vCPU_expander:            
@@ -221,9 +300,25 @@ if uploaded_file is not None and uploaded_file_valid is True and len(vCluster_se
                 st.table(vCPU_provisioned_df)
             with column_vCPU_2:
                 st.markdown("<h5 style='text-align: left; color:#034ea2; '><u>vCPU-Verteilung</u></h5>", unsafe_allow_html=True)
-                cpu_chart, cpu_chart_config = custom_functions.generate_cpu_bar_chart(df_vCPU_filtered)
+                cpu_chart, cpu_chart_config = custom_functions.generate_cpu_bar_chart(vCPU_histogram_index, vCluster_selected)
                 st.plotly_chart(cpu_chart,use_container_width=True, config=cpu_chart_config)
 
+            if derive_mode:
+                st.write('vCPU und vMemory wurden aus vInfo abgeleitet. Eine Stichprobe kann mit den vCPU / vMemory Tabs der RVTools Auswertung abgeglichen werden.')
+                if st.button('Stichprobe gegen vCPU / vMemory Tabs prüfen'):
+                    try:
+                        with st.spinner('Stichprobe wird eingelesen ...'):
+                            consistency_sample_amount, consistency_differences_df = custom_functions.check_vCPU_vMemory_consistency(uploaded_file, df_vInfo)
+                        if consistency_differences_df.shape[0] == 0:
+                            st.success(f"Keine Abweichungen in {consistency_sample_amount} geprüften Zeilen der vCPU / vMemory Tabs.")
+                        else:
+                            st.warning(f"{consistency_differences_df.shape[0]} Abweichungen in {consistency_sample_amount} geprüften Zeilen der vCPU / vMemory Tabs:")
+                            st.dataframe(consistency_differences_df)
+                    except custom_functions.RVToolsValidationError as e:
+                        st.warning(str(e))
+                    except custom_functions.ParseQueueFullError:
+                        st.warning('Aktuell werden zu viele RVTools Auswertungen gleichzeitig eingelesen. Bitte versuchen Sie es in wenigen Minuten erneut.')
+
         vRAM_expander = st.expander(label='vMemory Details')
         with vRAM_expander:
 
@@ -235,19 +330,22 @@ if uploaded_file is not None and uploaded_file_valid is True and len(vCluster_se
 
             with column_vRAM_plot:
                 st.markdown("<h5 style='text-align: left; color:#034ea2; '><u>vMemory-Verteilung</u></h5>", unsafe_allow_html=True)
-                bar_chart_vMemory, vMemory_bar_chart_config = custom_functions.generate_memory_bar_chart(df_vMemory_filtered)
+                bar_chart_vMemory, vMemory_bar_chart_config = custom_functions.generate_memory_bar_chart(vMemory_histogram_index, vCluster_selected)
                 st.plotly_chart(bar_chart_vMemory,use_container_width=True, config=vMemory_bar_chart_config)                
 
         vStorage_expander = st.expander(label='vStorage Details')
         with vStorage_expander:
                                    
-            vPartition_df, vDisk_df, vDataStore_df, vm_storage_df, vInfo_df = custom_functions.generate_vStorage_overview_df(df_vDisk_filtered,df_vPartition_filtered,df_vDataStore,df_vInfo_filtered)            
+            vPartition_df, vDisk_df, vDataStore_df, vm_storage_df, vInfo_df = custom_functions.generate_vStorage_overview_df(df_vDisk_filtered,df_vPartition_filtered,df_vDataStore_filtered,df_vInfo_filtered)            
                 
             column_vDatastore, column_vInfo = st.columns(2)
             with column_vDatastore:
                 st.markdown("<h5 style='text-align: left; color:#034ea2; '><u>vDatastore Auswertung</u></h5>", unsafe_allow_html=True)
                 st.table(vDataStore_df)
-                st.write('vDatastore enthält sämtliche Datastores die in vCenter hinterlegt sind. Diese lassen sich nicht ohne Weiteres auf einzelne VMs oder Cluster herunterbrechen und die Storage Kapazität kann z.B. durch lokale Datastores oder Backup Storage höher erscheinen als für den VM Workload tatsächlich benötigt.')
+                if datastore_cluster_index['available']:
+                    st.write('vDatastore enthält die Datastores, die mit mindestens einem Host der ausgewählten Cluster verbunden sind. Datastores die von mehreren Clustern genutzt werden, sind vollständig enthalten. Die Storage Kapazität kann z.B. durch lokale Datastores oder Backup Storage höher erscheinen als für den VM Workload tatsächlich benötigt.')
+                else:
+                    st.write('vDatastore enthält sämtliche Datastores die in vCenter hinterlegt sind. Diese lassen sich nicht ohne Weiteres auf einzelne VMs oder Cluster herunterbrechen und die Storage Kapazität kann z.B. durch lokale Datastores oder Backup Storage höher erscheinen als für den VM Workload tatsächlich benötigt.')
             with column_vInfo:
                 st.markdown("<h5 style='text-align: left; color:#034ea2; '><u>vInfo Storage Auswertung</u></h5>", unsafe_allow_html=True)
                 st.table(vInfo_df)
@@ -262,7 +360,7 @@ if uploaded_file is not None and uploaded_file_valid is True and len(vCluster_se
                 st.table(vDisk_df)
             with column_vDisk_plot:
                 st.markdown("<h5 style='text-align: left; color:#034ea2; '><u>vDisk Verteilung</u></h5>", unsafe_allow_html=True)
-                bar_chart_vDisk, vDisk_bar_chart_config = custom_functions.generate_vDisk_bar_chart(df_vDisk_filtered)                
+                bar_chart_vDisk, vDisk_bar_chart_config = custom_functions.generate_vDisk_bar_chart(vDisk_histogram_index, vCluster_selected)                
                 st.plotly_chart(bar_chart_vDisk,use_container_width=True, config=vDisk_bar_chart_config)      
 
             st.markdown("<h5 style='text-align: left; color:#034ea2; '><u>VM Storage Auswertung</u></h5>", unsafe_allow_html=True)
@@ -276,6 +374,43 @@ if uploaded_file is not None and uploaded_file_valid is True and len(vCluster_se
                 storage_chart, storage_chart_config = custom_functions.generate_vm_storage_chart(vm_storage_df)
                 st.plotly_chart(storage_chart,use_container_width=True, config=storage_chart_config)    
    
+    with history_section:
+        st.markdown("---")
+        st.markdown('### Kapazitäts-Historie & Wachstumsprognose')
+
+        history_expander = st.expander(label='Kapazitäts-Historie')
+        with history_expander:
+            column_history_customer, column_history_date = st.columns(2)
+            with column_history_customer:
+                history_customer = st.text_input('Kunde:', key='history_customer')
+            with column_history_date:
+                history_export_date = st.date_input('Datum des RVTools Exports:', value=custom_functions.read_xlsx_creation_date(uploaded_file))
+
+            if history_customer:
+                if st.button('RVTools Export in Historie speichern'):
+                    cluster_capacity_df = custom_functions.generate_cluster_capacity_df(df_vInfo, df_vCPU, df_vMemory, df_vDisk, df_vPartition, df_vHosts, df_vDataStore)
+                    custom_functions.store_cluster_capacity(history_customer, history_export_date, custom_functions.calculate_upload_digest(uploaded_file), cluster_capacity_df)
+                    st.success(f"Der RVTools Export vom {history_export_date.strftime('%d.%m.%Y')} wurde für {cluster_capacity_df.shape[0]} Cluster in der Historie gespeichert.")
+
+                history_date_range = custom_functions.query_capacity_date_range(history_customer)
+                trend_df = None
+                if history_date_range is not None:
+                    history_date_selected = st.date_input('Zeitraum der Historie:', value=history_date_range)
+                    history_date_from, history_date_to = history_date_selected[0], (history_date_selected[-1] if len(history_date_selected) > 1 else history_date_range[1]) # end date is missing while the range is being selected
+                    trend_df = custom_functions.query_capacity_trend(history_customer, vCluster_selected, history_date_from, history_date_to)
+                if trend_df is not None and trend_df.shape[0] > 0:
+                    trend_chart, trend_chart_config = custom_functions.generate_capacity_trend_chart(trend_df)
+                    st.plotly_chart(trend_chart, use_container_width=True, config=trend_chart_config)
+
+                    growth_forecast = custom_functions.generate_growth_forecast(trend_df)
+                    forecast_df = pd.DataFrame({'': [custom_functions.history_metric_labels[metric] for metric in growth_forecast], f"Wachstum in {custom_functions.forecast_years:g} Jahren (%)": list(growth_forecast.values())})
+                    st.table(forecast_df.style.format(na_rep='nicht vorhanden', precision=0))
+                    st.write('Die Prognose basiert auf einem linearen Trend über die gespeicherten RVTools Exports der ausgewählten Cluster im gewählten Zeitraum (mindestens 2 Exports mit unterschiedlichem Datum notwendig).')
+                    if st.button('Prognose als Wachstum für das Sizing übernehmen'):
+                        custom_functions.apply_growth_forecast(growth_forecast)
+                else:
+                    st.write('Für diesen Kunden, die ausgewählten Cluster und den gewählten Zeitraum sind keine RVTools Exports in der Historie gespeichert.')
+
     with sizing_section: 
         st.markdown("---")            
         st.markdown('### Sizing-Eckdaten-Berechnung')
@@ -355,3 +490,44 @@ if uploaded_file is not None and uploaded_file_valid is True and len(vCluster_se
             custom_functions.calculate_sizing_result_vStorage(vm_storage_df)  
             st.metric(label="", value=st.session_state['vStorage_basis']+" TiB")
             st.metric(label="", value=st.session_state['vStorage_final']+" TiB", delta=st.session_state['vStorage_growth']+" TiB")
+
+    with report_section:
+        st.markdown("---")
+        st.markdown('### Report-Export')
+        st.write('Der Report enthält sämtliche Auswertungs-Tabellen, das Sizing-Ergebnis sowie Detail-Tabellen je VM (vCPU, vRAM, vStorage Quelle, Gastbetriebssystem) für die ausgewählten Cluster.')
+
+        if st.button('Report erstellen'):
+            with st.spinner('Report wird erstellt ...'):
+                # Reuse already calculated tables of the analysis section
+                vCluster_df = pd.DataFrame({
+                    '': ["Datacenter", "Cluster", "Host", "VMs", "pCPU verwendet", "pCPU verfügbar", "pMemory verwendet", "pMemory verfügbar", "vDatastore verwendet", "vDatastore zugewiesen"],
+                    'Werte': [str(df_vInfo_filtered['Datacenter'].nunique()), str(df_vInfo_filtered['Cluster'].nunique()), str(df_vInfo_filtered['Host'].nunique()), str(df_vInfo_filtered.shape[0]),
+                        f"{consumed_ghz} GHz", f"{total_ghz} GHz", f"{consumed_memory} GiB", f"{total_memory} GiB", f"{storage_consumed} TiB", f"{storage_provisioned} TiB"]
+                })
+                report_tables = {
+                    'vCluster Übersicht': vCluster_df,
+                    'pCPU Details': pCPU_df, 'pMemory Details': memory_df, 'pHost Details': hardware_df,
+                    'Top 10 VMs: vCPU (On)': top_vms_vCPU, 'Top 10 VMs: vMemory (On)': top_vms_vMemory, 'Top 10 VMs: vStorage consumed': top_vms_vStorage_consumed,
+                    'Gastbetriebssysteme nach Configurations-File': guest_os_df_config, 'Gastbetriebssysteme nach VMware Tools': guest_os_df_tools,
+                    'Abweichungen Configurations-File / VMware Tools': guest_os_mismatch_df,
+                    'vCPU Auswertung': vCPU_provisioned_df, 'vMemory Auswertung': vRAM_provisioned_df,
+                    'vDatastore Auswertung': vDataStore_df, 'vInfo Storage Auswertung': vInfo_df, 'vPartition Auswertung': vPartition_df, 'vDisk Auswertung': vDisk_df,
+                    'VM Storage Auswertung': vm_storage_df,
+                }
+                sizing_result_df = custom_functions.generate_sizing_result_df()
+                vm_detail_sheets = custom_functions.generate_vm_detail_sheets(df_vInfo_filtered, df_vCPU_filtered, df_vMemory_filtered, df_vDisk_filtered, df_vPartition_filtered, guest_os_classification)
+
+                report_directory = tempfile.mkdtemp()
+                report_xlsx_path = os.path.join(report_directory, 'RVTools_Analyse.xlsx')
+                report_html_path = os.path.join(report_directory, 'RVTools_Analyse.html')
+                custom_functions.export_report_xlsx(report_xlsx_path, report_tables, sizing_result_df, vm_detail_sheets)
+                custom_functions.export_report_html(report_html_path, report_tables, sizing_result_df, vm_detail_sheets)
+
+            column_report_xlsx, column_report_html = st.columns(2)
+            with column_report_xlsx:
+                with open(report_xlsx_path, 'rb') as report_file:
+                    st.download_button('Report als Excel herunterladen', report_file, file_name='RVTools_Analyse.xlsx', mime='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet')
+            with column_report_html:
+                with open(report_html_path, 'rb') as report_file:
+                    st.download_button('Report als HTML herunterladen', report_file, file_name='RVTools_Analyse.html', mime='text/html')
+            shutil.rmtree(report_directory, ignore_errors=True)
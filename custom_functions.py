@@ -11,6 +11,28 @@ from datetime import datetime
 from botocore.exceptions import ClientError
 import requests
 import json
+import re
+import zipfile
+import posixpath
+import xml.etree.ElementTree as ET
+import os
+import io
+import mmap
+import shutil
+import hashlib
+import tempfile
+import threading
+import time
+import multiprocessing
+from concurrent.futures import Future, ProcessPoolExecutor, wait, FIRST_COMPLETED
+from concurrent.futures.process import BrokenProcessPool
+from collections import OrderedDict
+from contextlib import closing, contextmanager
+import html
+import xlsxwriter
+import openpyxl
+import sqlite3
+from plotly.subplots import make_subplots
 
 ######################
 # Initialize variables
@@ -18,6 +40,126 @@ import json
 # background nutanix logo for diagrams
 background_image = dict(source=Image.open("images/nutanix-x.png"), xref="paper", yref="paper", x=0.5, y=0.5, sizex=0.95, sizey=0.95, xanchor="center", yanchor="middle", opacity=0.04, layer="below", sizing="contain")
 
+# Rule set to normalise guest OS strings into family / version / licensing buckets
+# Each rule: (regex, family, licensing) - a named group "version" in the regex is used as version, first matching rule wins
+guest_os_rules = (
+    (r'Windows Server (?P<version>\d{4}(?: R2)?)', 'Windows Server', 'Microsoft Windows Server'),
+    (r'Windows (?P<version>XP|Vista|7|8\.1|8|10|11)\b', 'Windows Client', 'Microsoft Windows Client'),
+    (r'Windows', 'Windows Sonstige', 'Microsoft'),
+    (r'Red Hat Enterprise Linux (?P<version>\d+)', 'Linux', 'Red Hat Subscription'),
+    (r'SUSE Linux Enterprise(?: Server)? (?P<version>\d+)', 'Linux', 'SUSE Subscription'),
+    (r'Oracle Linux (?P<version>\d+)', 'Linux', 'Oracle Linux Support'),
+    (r'CentOS(?: Linux)? (?P<version>\d+)', 'Linux', 'Open Source'),
+    (r'Rocky Linux (?P<version>\d+)', 'Linux', 'Open Source'),
+    (r'AlmaLinux (?P<version>\d+)', 'Linux', 'Open Source'),
+    (r'Ubuntu(?: Linux)? ?(?P<version>\d+\.\d+)?', 'Linux', 'Open Source'),
+    (r'Debian GNU/Linux (?P<version>\d+)', 'Linux', 'Open Source'),
+    (r'Photon OS', 'Linux', 'Open Source'),
+    (r'Linux', 'Linux', 'Unbekannt'),
+    (r'FreeBSD (?P<version>\d+)', 'BSD', 'Open Source'),
+    (r'Solaris (?P<version>\d+)', 'Unix', 'Oracle Solaris'),
+    (r'ESXi? (?P<version>\d+\.\d+)', 'VMware ESXi', 'VMware'),
+)
+# Guest OS classifications (one row per VM) kept in the cache - one entry per upload
+guest_os_classification_cache_entries = 8
+
+# Bin edges & labels for vDisk distribution (GiB) - as lower end will be included in bin added .01 to ensure correct bins
+vDisk_histogram_bins = (0, 10.01, 100.01, 1024.01, 2048.01, 4096.01, 63488.01)
+vDisk_histogram_labels = ('0 - 10 GB', '>10 - 100 GB', '>100 GB - 1 TB', '>1 TB - 2 TB', '>2 TB - 4TB', '> 4 TB')
+
+# Columns to read from Excel file
+vInfo_cols_to_use = ['VM','Powerstate','CPUs','Memory','Provisioned MiB','In Use MiB','Datacenter','Cluster','Host','OS according to the configuration file','OS according to the VMware Tools','VM ID']
+vCPU_cols_to_use = ['VM','Powerstate','CPUs','Cluster','VM ID']
+vMemory_cols_to_use = ['VM','Powerstate','Size MiB','Cluster','VM ID']
+vDisk_cols_to_use = ['Powerstate', 'Capacity MiB', 'Thin','Cluster','VM ID']
+vPartition_cols_to_use = ['Powerstate', 'Capacity MiB','Consumed MiB','Cluster','VM ID']
+vHosts_cols_to_use = ['Host', 'Cluster', 'Speed', '# CPU', 'Cores per CPU', '# Cores','CPU usage %', '# Memory', 'Memory usage %', '# VMs']
+vDatastore_cols_to_use = ['Capacity MiB','Provisioned MiB','In Use MiB','Object ID']
+rvtools_cols_to_use = {
+    'vInfo': vInfo_cols_to_use, 'vCPU': vCPU_cols_to_use, 'vMemory': vMemory_cols_to_use, 'vDisk': vDisk_cols_to_use,
+    'vPartition': vPartition_cols_to_use, 'vHost': vHosts_cols_to_use, 'vDatastore': vDatastore_cols_to_use,
+}
+
+# Optional columns - read if available, not reported as missing
+rvtools_optional_cols_to_use = {
+    'vDatastore': ['Hosts'],
+}
+
+# Alias table for column names of other RVTools versions - alias: column name used in *_cols_to_use (applies to all tabs)
+rvtools_column_aliases = {
+    'Provisioned MB': 'Provisioned MiB',
+    'In Use MB': 'In Use MiB',
+    'Size MB': 'Size MiB',
+    'Capacity MB': 'Capacity MiB',
+    'Consumed MB': 'Consumed MiB',
+    'Power state': 'Powerstate',
+    'Power State': 'Powerstate',
+    'Num CPU': 'CPUs',
+    'Memory MB': 'Memory',
+    'OS according to the configuration': 'OS according to the configuration file',
+    'OS according to VMware Tools': 'OS according to the VMware Tools',
+    'VM UUID': 'VM ID',
+    '# Cpu': '# CPU',
+    'CPU Usage %': 'CPU usage %',
+    'Memory Usage %': 'Memory usage %',
+    '# VM': '# VMs',
+}
+
+# Memory budget (MiB) for parsed analysis frames per session and per process - least recently used frames get evicted if exceeded
+session_memory_budget_mib = int(os.environ.get('RVTOOLS_SESSION_MEMORY_BUDGET_MIB', 1024))
+process_memory_budget_mib = int(os.environ.get('RVTOOLS_PROCESS_MEMORY_BUDGET_MIB', 4096))
+spool_chunk_size = 8 * 1024 * 1024
+
+# Process wide store of parsed analysis frames: digest -> {'frames', 'nbytes', 'sessions'}, ordered by last access
+analysis_frame_store = OrderedDict()
+analysis_frame_store_lock = threading.Lock()
+
+# Process wide parse scheduler: bounded worker pool, jobs for the same content digest are coalesced
+parse_worker_amount = int(os.environ.get('RVTOOLS_PARSE_WORKERS', 2))
+parse_queue_limit = int(os.environ.get('RVTOOLS_PARSE_QUEUE_LIMIT', 20))
+parse_executor = None
+parse_jobs = OrderedDict() # digest -> {'executor', 'futures', 'stages', 'column_mapping', 'spooled_path', 'sessions', 'submitted'}, ordered by submission
+parse_submitted_futures = [] # futures (parse stages & tasks) in the worker pool in submission order
+# Order of the parsed frames & tabs per stage in progressive mode - small vHost alone first (pCPU / pMemory), then vInfo (headline numbers, derived vCPU / vMemory), then the rest
+# Stages of a job run one after another (one worker per job), each stage is queued again behind the jobs waiting at that time - every stage opens the workbook again, so there are as few as possible
+rvtools_frame_order = ('vInfo', 'vCPU', 'vMemory', 'vDisk', 'vPartition', 'vHost', 'vDatastore')
+progressive_parse_stages = (('vHost',), ('vInfo',), ('vCPU', 'vMemory', 'vDisk', 'vPartition', 'vDatastore'))
+
+# vCPU & vMemory can be derived from vInfo (CPUs / Memory) instead of parsing both tabs, consistency check compares a sample of the real tabs
+derived_sheets = ('vCPU', 'vMemory')
+derive_vCPU_vMemory_from_vInfo = os.environ.get('RVTOOLS_DERIVE_VCPU_VMEMORY', '1') != '0'
+consistency_sample_size = int(os.environ.get('RVTOOLS_CONSISTENCY_SAMPLE_SIZE', 1000))
+parse_jobs_lock = threading.Lock()
+
+# Rows per chunk of the per VM detail sheets in the report export
+vm_detail_chunk_size = int(os.environ.get('RVTOOLS_REPORT_CHUNK_SIZE', 10000))
+
+# Sizing options (row in vCPU / vMemory / VM Storage overview table) - options marked with * are the recommended defaults
+sizing_options = {
+    'vCPU': {'vCPUs VMs - On *': 0, 'vCPUs VMs - Total (On/Off/Suspended)': 3},
+    'vRAM': {'vMemory VMs - On *': 0, 'vMemory VMs - Total (On/Off/Suspended)': 3},
+    'vStorage': {'Consumed VM Storage - Total (On/Off/Suspended) *': 5, 'Consumed VM Storage - On': 3, 'Provisioned VM Storage - Total (On/Off/Suspended)': 8, 'Provisioned VM Storage - On': 6},
+}
+sizing_default_growth = {'vCPU': 10, 'vRAM': 30, 'vStorage': 20}
+
+# Historical capacity store (SQLite) and growth forecast horizon in years
+history_db_path = os.environ.get('RVTOOLS_HISTORY_DB', 'history/rvtools_history.sqlite')
+forecast_years = float(os.environ.get('RVTOOLS_FORECAST_YEARS', 3))
+history_metrics = ('vcpu_on', 'vcpu_total', 'vram_on_gib', 'vram_total_gib', 'storage_consumed_on_tib', 'storage_consumed_total_tib', 'storage_provisioned_on_tib', 'storage_provisioned_total_tib')
+# Sizing selectbox option -> history metric used for the growth forecast
+sizing_history_metrics = {
+    'vCPUs VMs - On *': 'vcpu_on',
+    'vCPUs VMs - Total (On/Off/Suspended)': 'vcpu_total',
+    'vMemory VMs - On *': 'vram_on_gib',
+    'vMemory VMs - Total (On/Off/Suspended)': 'vram_total_gib',
+    'Consumed VM Storage - Total (On/Off/Suspended) *': 'storage_consumed_total_tib',
+    'Consumed VM Storage - On': 'storage_consumed_on_tib',
+    'Provisioned VM Storage - Total (On/Off/Suspended)': 'storage_provisioned_total_tib',
+    'Provisioned VM Storage - On': 'storage_provisioned_on_tib',
+}
+# Labels of the history metrics on the page - same as the sizing options
+history_metric_labels = {metric: sizing_option for sizing_option, metric in sizing_history_metrics.items()}
+
 ######################
 # Custom Functions
 ######################
@@ -28,30 +170,614 @@ def local_css(file_name):
         return f.read()
 
 # Generate Dataframe from Excel and make neccessary adjustment for easy consumption later on
-@st.cache(allow_output_mutation=True)
-def get_data_from_excel(uploaded_file):
+# No @st.cache here - parsed frames are kept in analysis_frame_store with a memory budget (see load_analysis_frames)
+def get_data_from_excel(uploaded_file, column_mapping=None, derive_vCPU_vMemory=False):
 
-    df = pd.ExcelFile(uploaded_file, engine="openpyxl")
+    # Column mapping from validation (RVTools column name -> column name used in *_cols_to_use) in order to support other RVTools versions
+    if column_mapping is None:
+        validation_result = validate_rvtools_workbook(uploaded_file, get_required_cols_to_use(derive_vCPU_vMemory))
+        if not validation_result['valid']:
+            raise RVToolsValidationError(format_validation_result(validation_result))
+        column_mapping = validation_result['column_mapping']
+    parsed_sheets = get_sheets_from_excel(uploaded_file, column_mapping, get_sheets_to_parse(rvtools_frame_order, derive_vCPU_vMemory))
+
+    return assemble_analysis_frames(parsed_sheets)
+
+# Tabs needed for the analysis - vCPU & vMemory are not required if derived from vInfo
+def get_required_cols_to_use(derive_vCPU_vMemory):
+
+    return {sheet_name: cols for sheet_name, cols in rvtools_cols_to_use.items() if not (derive_vCPU_vMemory and sheet_name in derived_sheets)}
+
+# Tabs to parse (of a stage) - vCPU & vMemory are skipped if derived from vInfo
+def get_sheets_to_parse(sheet_names, derive_vCPU_vMemory):
+
+    return tuple(sheet_name for sheet_name in sheet_names if not (derive_vCPU_vMemory and sheet_name in derived_sheets))
+
+# Add vCPU & vMemory derived from vInfo if these tabs were not parsed (same columns as the tabs)
+def add_derived_sheets(parsed_sheets):
+
+    if 'vInfo' in parsed_sheets:
+        df_vInfo = parsed_sheets['vInfo']
+        if 'vCPU' not in parsed_sheets:
+            parsed_sheets['vCPU'] = df_vInfo[vCPU_cols_to_use].copy()
+        if 'vMemory' not in parsed_sheets:
+            parsed_sheets['vMemory'] = df_vInfo[['VM', 'Powerstate', 'Memory', 'Cluster', 'VM ID']].rename(columns={'Memory': 'Size MiB'})
+
+    return parsed_sheets
 
-    # Columns to read from Excel file
-    vInfo_cols_to_use = ['VM','Powerstate','CPUs','Memory','Provisioned MiB','In Use MiB','Datacenter','Cluster','Host','OS according to the configuration file','OS according to the VMware Tools','VM ID']
-    vCPU_cols_to_use = ['VM','Powerstate','CPUs','Cluster','VM ID']
-    vMemory_cols_to_use = ['VM','Powerstate','Size MiB','Cluster','VM ID']
-    vDisk_cols_to_use = ['Powerstate', 'Capacity MiB', 'Thin','Cluster','VM ID']
-    vPartition_cols_to_use = ['Powerstate', 'Capacity MiB','Consumed MiB','Cluster','VM ID']
-    vHosts_cols_to_use = ['Cluster', 'Speed', '# CPU', 'Cores per CPU', '# Cores','CPU usage %', '# Memory', 'Memory usage %', '# VMs']
-    vDatastore_cols_to_use = ['Capacity MiB','Provisioned MiB','In Use MiB','Object ID']
+# Frames in the order used by app (df_vInfo, df_vCPU, df_vMemory, df_vDisk, df_vPartition, df_vHosts, df_vDataStore)
+def assemble_analysis_frames(parsed_sheets):
+
+    parsed_sheets = add_derived_sheets(dict(parsed_sheets))
+
+    return tuple(parsed_sheets[sheet_name] for sheet_name in rvtools_frame_order)
+
+# Parse only the given tabs - openpyxl reads the workbook read-only, tabs that are not requested are not loaded
+def get_sheets_from_excel(uploaded_file, column_mapping, sheet_names):
+
+    df = pd.ExcelFile(uploaded_file, engine="openpyxl")
 
     # Create df for each tab with only relevant columns
-    df_vInfo = df.parse('vInfo', usecols=vInfo_cols_to_use)
-    df_vCPU = df.parse('vCPU', usecols=vCPU_cols_to_use)
-    df_vMemory = df.parse('vMemory', usecols=vMemory_cols_to_use)
-    df_vDisk = df.parse('vDisk', usecols=vDisk_cols_to_use)
-    df_vPartition = df.parse('vPartition', usecols=vPartition_cols_to_use)
-    df_vHosts = df.parse('vHost', usecols=vHosts_cols_to_use)
-    df_vDataStore = df.parse('vDatastore', usecols=vDatastore_cols_to_use)
+    parsed_sheets = {sheet_name: parse_rvtools_sheet(df, sheet_name, column_mapping) for sheet_name in sheet_names}
+    df.close() # release openpyxl workbook
+
+    return parsed_sheets
+
+# Raised if the pre-flight validation finds missing tabs / columns
+class RVToolsValidationError(ValueError):
+    pass
+
+# Read-only file object on top of a memory map (mmap itself is not seekable() for zipfile / openpyxl)
+class MappedFile(io.RawIOBase):
+
+    def __init__(self, mapped_file):
+        self.mapped_file = mapped_file
+
+    def readable(self):
+        return True
 
-    return df_vInfo, df_vCPU, df_vMemory, df_vDisk, df_vPartition, df_vHosts, df_vDataStore
+    def seekable(self):
+        return True
+
+    def readinto(self, buffer):
+        data = self.mapped_file.read(len(buffer))
+        buffer[:len(data)] = data
+        return len(data)
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        try:
+            self.mapped_file.seek(offset, whence)
+        except ValueError as e: # mmap raises ValueError for positions outside of the file, files raise OSError (expected by zipfile)
+            raise OSError(str(e))
+        return self.mapped_file.tell()
+
+    def tell(self):
+        return self.mapped_file.tell()
+
+# Spool upload in chunks into a temp file - caller has to remove the file (non seekable uploads are read from the current position)
+def spool_uploaded_file(uploaded_file):
+
+    if uploaded_file.seekable():
+        uploaded_file.seek(0)
+    with tempfile.NamedTemporaryFile(suffix='.xlsx', delete=False) as spooled_file:
+        try:
+            shutil.copyfileobj(uploaded_file, spooled_file, spool_chunk_size)
+        except BaseException: # e.g. connection timeout of the service - no partial spool left behind
+            spooled_file.close()
+            os.remove(spooled_file.name)
+            raise
+    if uploaded_file.seekable():
+        uploaded_file.seek(0)
+
+    return spooled_file.name
+
+# Provide a spooled file memory mapped - map is released when leaving the context (empty files can not be mapped)
+@contextmanager
+def open_mapped_file(spooled_path):
+
+    if os.path.getsize(spooled_path) == 0:
+        raise RVToolsValidationError("Die Datei ist leer und keine lesbare Excel (xlsx) Datei.")
+    with open(spooled_path, 'rb') as spooled_file:
+        with mmap.mmap(spooled_file.fileno(), 0, access=mmap.ACCESS_READ) as mapped_file:
+            spooled_mapped_file = MappedFile(mapped_file)
+            try:
+                yield spooled_mapped_file
+            finally:
+                spooled_mapped_file.close()
+
+# Content digest of the upload (used as key for parsed frames)
+def calculate_upload_digest(uploaded_file):
+
+    digest = hashlib.sha256()
+    uploaded_file.seek(0)
+    for chunk in iter(lambda: uploaded_file.read(spool_chunk_size), b''):
+        digest.update(chunk)
+    uploaded_file.seek(0)
+
+    return digest.hexdigest()
+
+# Format missing tabs / columns of a validation result as markdown list
+def format_validation_result(validation_result):
+
+    missing_list = ''.join(f"* ***{sheet_name}***: Tab fehlt\n" for sheet_name in validation_result['missing_sheets'])
+    missing_list += ''.join(f"* ***{sheet_name}***: {', '.join(columns)}\n" for sheet_name, columns in validation_result['missing_columns'].items())
+
+    return "Folgende Tabs / Spalten fehlen in der RVTools Excel Datei:\n"+missing_list
+
+# Evict least recently used frames until session & process budget are met - frames of keep_digest are never evicted
+# Needs analysis_frame_store_lock
+def enforce_memory_budget(session_id, keep_digest):
+
+    def evict(owned_by_session):
+        for digest, entry in list(analysis_frame_store.items()):
+            if digest != keep_digest and (not owned_by_session or session_id in entry['sessions']):
+                del analysis_frame_store[digest]
+                return True
+        return False
+
+    while sum(entry['nbytes'] for entry in analysis_frame_store.values() if session_id in entry['sessions']) > session_memory_budget_mib * 1048576:
+        if not evict(owned_by_session=True):
+            break
+    while sum(entry['nbytes'] for entry in analysis_frame_store.values()) > process_memory_budget_mib * 1048576:
+        if not evict(owned_by_session=False):
+            break
+
+# Store parsed frames for the given sessions and apply memory budget
+def store_analysis_frames(digest, frames, sessions):
+
+    with analysis_frame_store_lock:
+        if digest not in analysis_frame_store:
+            analysis_frame_store[digest] = {
+                'frames': frames,
+                'nbytes': sum(int(frame.memory_usage(index=True, deep=True).sum()) for frame in frames),
+                'sessions': set(),
+            }
+        analysis_frame_store[digest]['sessions'].update(sessions)
+        analysis_frame_store.move_to_end(digest)
+        for session_id in sessions:
+            enforce_memory_budget(session_id, digest)
+
+# Key of parsed frames in analysis_frame_store - frames with vCPU & vMemory derived from vInfo are stored separately from fully parsed ones
+def get_analysis_frames_key(upload_digest, derive_vCPU_vMemory):
+
+    return upload_digest + ('-vInfo' if derive_vCPU_vMemory else '')
+
+# Parsed frames from analysis_frame_store (None if not parsed yet or evicted) - session is added as user of the frames
+def get_stored_analysis_frames(frames_key, session_id):
+
+    with analysis_frame_store_lock:
+        if frames_key not in analysis_frame_store:
+            return None
+        analysis_frame_store.move_to_end(frames_key)
+        analysis_frame_store[frames_key]['sessions'].add(session_id)
+        enforce_memory_budget(session_id, frames_key)
+        return analysis_frame_store[frames_key]['frames']
+
+# Raised if too many parse jobs are waiting
+class ParseQueueFullError(RuntimeError):
+    pass
+
+# Raised if frames of an upload are requested by digest but not (or no longer) stored
+class AnalysisFramesNotStoredError(LookupError):
+    pass
+
+# Worker pool is created on first use - spawn instead of fork as the Streamlit server is multithreaded
+# Needs parse_jobs_lock
+def get_parse_executor():
+    global parse_executor
+
+    if parse_executor is None:
+        parse_executor = ProcessPoolExecutor(max_workers=parse_worker_amount, mp_context=multiprocessing.get_context('spawn'))
+
+    return parse_executor
+
+# Drop a broken worker pool (a worker died, e.g. killed out of memory) - the next job creates a new pool
+# Needs parse_jobs_lock
+def discard_parse_executor(broken_executor):
+    global parse_executor
+
+    if parse_executor is broken_executor:
+        parse_executor = None
+    broken_executor.shutdown(wait=False)
+
+# Submit to the worker pool - a broken worker pool is replaced once
+# Needs parse_jobs_lock
+def submit_to_parse_executor(function, *args):
+
+    executor = get_parse_executor()
+    try:
+        future = executor.submit(function, *args)
+    except BrokenProcessPool:
+        discard_parse_executor(executor)
+        executor = get_parse_executor()
+        future = executor.submit(function, *args)
+    parse_submitted_futures.append(future)
+
+    return executor, future
+
+# Result of a task in the worker pool - if a worker died only this task fails, the broken pool is replaced for the next tasks
+def get_parse_task_result(executor, future):
+
+    try:
+        return future.result()
+    except BrokenProcessPool:
+        with parse_jobs_lock:
+            discard_parse_executor(executor)
+        raise
+
+# Submit a single task besides the parse jobs (e.g. consistency check) - rejected like a parse job if the queue is full
+def submit_parse_task(function, *args):
+
+    with parse_jobs_lock:
+        if count_waiting_parse_jobs() >= parse_queue_limit:
+            raise ParseQueueFullError('Parse queue full ('+str(parse_queue_limit)+' jobs waiting)')
+        return submit_to_parse_executor(function, *args)
+
+# Runs in the worker process
+def parse_spooled_file(spooled_path, column_mapping, sheet_names):
+
+    with open_mapped_file(spooled_path) as mapped_file:
+        return get_sheets_from_excel(mapped_file, column_mapping, sheet_names)
+
+# Runs in the worker process - header & first sample_size rows of the tabs, openpyxl stops reading each tab after max_row
+def read_sample_spooled_file(spooled_path, column_mapping, sheet_names, sample_size):
+
+    sample_sheets = {}
+    with open_mapped_file(spooled_path) as mapped_file:
+        workbook = openpyxl.load_workbook(mapped_file, read_only=True, data_only=True)
+        try:
+            for sheet_name in sheet_names:
+                rows = workbook[sheet_name].iter_rows(min_row=1, max_row=sample_size + 1, values_only=True)
+                header = [str(column) if column is not None else None for column in next(rows, ())]
+                sheet_mapping = column_mapping.get(sheet_name, {})
+                positions = [position for position, column in enumerate(header) if column in sheet_mapping]
+                df_sample = pd.DataFrame(
+                    [[row[position] if position < len(row) else None for position in positions] for row in rows],
+                    columns=[sheet_mapping[header[position]] for position in positions],
+                )
+                sample_sheets[sheet_name] = df_sample.dropna(how='all').reset_index(drop=True)
+        finally:
+            workbook.close()
+
+    return sample_sheets
+
+# Futures processed by a worker right now - the pool works in submission order, so these are the first parse_worker_amount futures not done yet
+# (future.running() can not be used, it is already True while the future waits in the call queue of the pool)
+# Needs parse_jobs_lock
+def get_started_parse_futures():
+
+    parse_submitted_futures[:] = [future for future in parse_submitted_futures if not future.done()]
+
+    return set(parse_submitted_futures[:parse_worker_amount])
+
+# A parse job is waiting as long as none of its stages was started
+def is_parse_job_waiting(job, started_futures):
+
+    return not any(future.done() or future in started_futures for future in job['futures'])
+
+# Amount of waiting parse jobs
+# Needs parse_jobs_lock
+def count_waiting_parse_jobs():
+
+    started_futures = get_started_parse_futures()
+
+    return sum(is_parse_job_waiting(job, started_futures) for job in parse_jobs.values())
+
+# A stage failed (exception or cancelled)
+def is_parse_stage_failed(future):
+
+    return future.done() and (future.cancelled() or future.exception() is not None)
+
+# Done callback of a parse stage - submits the next stage of the job or finishes the job after the last / a failed stage
+def continue_parse_job(digest, job, future):
+
+    if not is_parse_stage_failed(future) and len(job['futures']) < len(job['stages']):
+        with parse_jobs_lock:
+            try:
+                job['executor'], next_future = submit_to_parse_executor(parse_spooled_file, job['spooled_path'], job['column_mapping'], job['stages'][len(job['futures'])])
+            except Exception as e: # e.g. pool shut down - fails the job for all waiting sessions
+                next_future = Future()
+                next_future.set_exception(e)
+            job['futures'].append(next_future)
+        next_future.add_done_callback(lambda future: continue_parse_job(digest, job, future))
+        return
+
+    finish_parse_job(digest, job)
+
+# Once all stages are done (or one failed) store frames for all waiting sessions and remove spooled file (raw bytes)
+def finish_parse_job(digest, job):
+
+    with parse_jobs_lock:
+        if parse_jobs.get(digest) is not job:
+            return
+        del parse_jobs[digest]
+    try:
+        os.remove(job['spooled_path'])
+    except FileNotFoundError:
+        pass
+    if len(job['futures']) == len(job['stages']) and not any(is_parse_stage_failed(future) for future in job['futures']):
+        parsed_sheets = {}
+        for future in job['futures']:
+            parsed_sheets.update(future.result())
+        store_analysis_frames(digest, assemble_analysis_frames(parsed_sheets), job['sessions'])
+
+# Submit parse job or join an already queued / running job for the same content digest
+# In progressive mode the tabs are parsed in stages (in order of progressive_parse_stages, next stage is submitted once the previous one is done)
+def submit_parse_job(uploaded_file, digest, session_id, progressive=False, derive_vCPU_vMemory=False):
+
+    with parse_jobs_lock:
+        if digest in parse_jobs:
+            parse_jobs[digest]['sessions'].add(session_id)
+            return parse_jobs[digest]
+        if count_waiting_parse_jobs() >= parse_queue_limit:
+            raise ParseQueueFullError('Parse queue full ('+str(parse_queue_limit)+' jobs waiting)')
+
+    # pre-flight check of tabs & columns (only sheet list and header rows are read) before queuing the full parse
+    spooled_path = spool_uploaded_file(uploaded_file)
+    try:
+        with open_mapped_file(spooled_path) as mapped_file:
+            validation_result = validate_rvtools_workbook(mapped_file, get_required_cols_to_use(derive_vCPU_vMemory))
+        if not validation_result['valid']:
+            raise RVToolsValidationError(format_validation_result(validation_result))
+    except Exception:
+        os.remove(spooled_path)
+        raise
+
+    stages = progressive_parse_stages if progressive else (rvtools_frame_order,)
+    stages = tuple(stage for stage in (get_sheets_to_parse(stage, derive_vCPU_vMemory) for stage in stages) if stage)
+    try:
+        with parse_jobs_lock:
+            existing_job = parse_jobs.get(digest) # same file was submitted by another session in the meantime
+            if existing_job is not None:
+                existing_job['sessions'].add(session_id)
+            else:
+                executor, future = submit_to_parse_executor(parse_spooled_file, spooled_path, validation_result['column_mapping'], stages[0])
+                job = {
+                    'executor': executor,
+                    'futures': [future],
+                    'stages': stages,
+                    'column_mapping': validation_result['column_mapping'],
+                    'spooled_path': spooled_path,
+                    'sessions': {session_id},
+                    'submitted': time.time(),
+                }
+                parse_jobs[digest] = job
+    except Exception:
+        os.remove(spooled_path)
+        raise
+    if existing_job is not None:
+        os.remove(spooled_path)
+        return existing_job
+    job['futures'][0].add_done_callback(lambda future: continue_parse_job(digest, job, future))
+
+    return job
+
+# Queue position of a parse job (1 = next one), 0 if already running or done
+def get_parse_queue_position(digest):
+
+    with parse_jobs_lock:
+        started_futures = get_started_parse_futures()
+        waiting_digests = [job_digest for job_digest, job in parse_jobs.items() if is_parse_job_waiting(job, started_futures)]
+
+    return waiting_digests.index(digest)+1 if digest in waiting_digests else 0
+
+# Load parsed frames for an upload - parsed once per content digest in the worker pool from a spooled, memory mapped copy of the upload
+# status_callback(queue_position, elapsed_seconds) is called while waiting
+# stage_callback(parsed_sheets) is called with all tabs parsed so far whenever a stage finished before the last one (progressive mode)
+# With derive_vCPU_vMemory the vCPU & vMemory tabs are not parsed but derived from vInfo (frames are stored separately from fully parsed ones)
+def load_analysis_frames(uploaded_file, session_id, status_callback=None, stage_callback=None, progressive=False, derive_vCPU_vMemory=derive_vCPU_vMemory_from_vInfo, upload_digest=None):
+
+    digest = get_analysis_frames_key(upload_digest or calculate_upload_digest(uploaded_file), derive_vCPU_vMemory)
+    frames = get_stored_analysis_frames(digest, session_id)
+    if frames is not None:
+        return frames
+
+    job = submit_parse_job(uploaded_file, digest, session_id, progressive, derive_vCPU_vMemory)
+    reported_stages = set()
+    parsed_sheets = {}
+    while True:
+        with parse_jobs_lock:
+            futures = list(job['futures']) # next stage is appended once the previous one is done
+        for stage_position, future in enumerate(futures):
+            if future.done() and stage_position not in reported_stages:
+                reported_stages.add(stage_position)
+                parsed_sheets.update(get_parse_task_result(job['executor'], future))
+                if stage_callback is not None and len(reported_stages) < len(job['stages']):
+                    stage_callback(add_derived_sheets(dict(parsed_sheets)) if derive_vCPU_vMemory else dict(parsed_sheets))
+        if len(reported_stages) == len(job['stages']):
+            break
+        if status_callback is not None:
+            status_callback(get_parse_queue_position(digest), time.time() - job['submitted'])
+        pending_futures = [future for future in futures if not future.done()]
+        if pending_futures:
+            wait(pending_futures, timeout=0.5, return_when=FIRST_COMPLETED)
+        else:
+            time.sleep(0.05) # next stage is about to be submitted
+
+    frames = assemble_analysis_frames(parsed_sheets)
+    store_analysis_frames(digest, frames, {session_id})
+
+    return frames
+
+# Sample-compare vCPU & vMemory derived from vInfo against the real tabs (first sample_size rows of each tab)
+# Sample is read in the parse worker pool (same queue as the parse jobs), returns amount of compared rows and a df with every difference
+def check_vCPU_vMemory_consistency(uploaded_file, df_vInfo, sample_size=consistency_sample_size):
+
+    spooled_path = spool_uploaded_file(uploaded_file)
+    try:
+        with open_mapped_file(spooled_path) as mapped_file:
+            validation_result = validate_rvtools_workbook(mapped_file, {sheet_name: rvtools_cols_to_use[sheet_name] for sheet_name in derived_sheets})
+        if not validation_result['valid']:
+            raise RVToolsValidationError(format_validation_result(validation_result))
+        executor, future = submit_parse_task(read_sample_spooled_file, spooled_path, validation_result['column_mapping'], derived_sheets, sample_size)
+        sample_sheets = get_parse_task_result(executor, future)
+    finally:
+        os.remove(spooled_path)
+
+    vInfo_lookup = df_vInfo.drop_duplicates(subset=['VM ID']).set_index('VM ID')
+    differences = []
+    for sheet_name, value_column, vInfo_column in [('vCPU', 'CPUs', 'CPUs'), ('vMemory', 'Size MiB', 'Memory')]:
+        df_sample = sample_sheets[sheet_name]
+        for sample_column, compare_column in [(value_column, vInfo_column), ('Powerstate', 'Powerstate'), ('Cluster', 'Cluster')]:
+            sample_values = df_sample[sample_column]
+            vInfo_values = vInfo_lookup[compare_column].reindex(df_sample['VM ID']).set_axis(df_sample.index)
+            different = (sample_values != vInfo_values) & ~(sample_values.isna() & vInfo_values.isna())
+            differences.append(pd.DataFrame({
+                'VM': df_sample.loc[different, 'VM'], 'VM ID': df_sample.loc[different, 'VM ID'], 'Tab': sheet_name, 'Spalte': sample_column,
+                'Wert Tab': sample_values[different].astype(str), 'Wert vInfo': vInfo_values[different].astype(str),
+            }))
+
+    differences_df = pd.concat(differences, ignore_index=True)
+    sample_amount = sum(df_sample.shape[0] for df_sample in sample_sheets.values())
+
+    return sample_amount, differences_df
+
+# Parse a single tab with only relevant columns and rename aliased columns
+def parse_rvtools_sheet(excel_file, sheet_name, column_mapping):
+
+    sheet_mapping = column_mapping.get(sheet_name, {})
+    df_sheet = excel_file.parse(sheet_name, usecols=list(sheet_mapping.keys()) or rvtools_cols_to_use[sheet_name])
+    df_sheet.rename(columns=sheet_mapping, inplace=True)
+
+    return df_sheet
+
+# Read the header row of a worksheet directly from the xlsx zip - stops after the first row
+def read_xlsx_header_row(xlsx_zip, sheet_path, namespace):
+
+    header_cells = []
+    with xlsx_zip.open(sheet_path) as sheet_xml:
+        for event, element in ET.iterparse(sheet_xml, events=('end',)):
+            if element.tag == namespace+'c':
+                cell_type = element.get('t')
+                if cell_type == 'inlineStr':
+                    cell_value = ''.join(text.text or '' for text in element.iter(namespace+'t'))
+                else:
+                    value_element = element.find(namespace+'v')
+                    cell_value = value_element.text if value_element is not None else None
+                header_cells.append((cell_type, cell_value))
+            elif element.tag == namespace+'row':
+                break
+    
+    return header_cells
+
+# Resolve shared string indices - stops as soon as the highest needed index is read
+def read_xlsx_shared_strings(xlsx_zip, needed_indices, namespace):
+
+    shared_strings = {}
+    if not needed_indices or 'xl/sharedStrings.xml' not in xlsx_zip.namelist():
+        return shared_strings
+
+    max_index = max(needed_indices)
+    string_index = 0
+    with xlsx_zip.open('xl/sharedStrings.xml') as shared_strings_xml:
+        for event, element in ET.iterparse(shared_strings_xml, events=('end',)):
+            if element.tag == namespace+'si':
+                if string_index in needed_indices:
+                    shared_strings[string_index] = ''.join(text.text or '' for text in element.iter(namespace+'t'))
+                element.clear()
+                if string_index >= max_index:
+                    break
+                string_index += 1
+
+    return shared_strings
+
+# Pre-flight validation of the RVTools workbook - only reads sheet list & header rows, not the full file
+def validate_rvtools_workbook(uploaded_file, cols_to_use=rvtools_cols_to_use, column_aliases=rvtools_column_aliases, optional_cols_to_use=rvtools_optional_cols_to_use):
+
+    namespace = '{http://schemas.openxmlformats.org/spreadsheetml/2006/main}'
+    relationship_namespace = '{http://schemas.openxmlformats.org/officeDocument/2006/relationships}'
+
+    uploaded_file.seek(0)
+    try:
+        with zipfile.ZipFile(uploaded_file) as xlsx_zip:
+            # Map sheet names to worksheet xml files
+            workbook_root = ET.fromstring(xlsx_zip.read('xl/workbook.xml'))
+            relationships_root = ET.fromstring(xlsx_zip.read('xl/_rels/workbook.xml.rels'))
+            relationship_targets = {relationship.get('Id'): relationship.get('Target') for relationship in relationships_root}
+            sheet_paths = {}
+            for sheet in workbook_root.iter(namespace+'sheet'):
+                target = relationship_targets.get(sheet.get(relationship_namespace+'id'), '')
+                sheet_paths[sheet.get('name')] = target.lstrip('/') if target.startswith('/') else posixpath.normpath(posixpath.join('xl', target))
+
+            missing_sheets = [sheet_name for sheet_name in cols_to_use if sheet_name not in sheet_paths]
+            header_cells = {sheet_name: read_xlsx_header_row(xlsx_zip, sheet_paths[sheet_name], namespace) for sheet_name in cols_to_use if sheet_name in sheet_paths}
+
+            shared_string_indices = {int(cell_value) for cells in header_cells.values() for cell_type, cell_value in cells if cell_type == 's' and cell_value is not None}
+            shared_strings = read_xlsx_shared_strings(xlsx_zip, shared_string_indices, namespace)
+    except (zipfile.BadZipFile, KeyError, ET.ParseError) as e: # no xlsx file or workbook parts missing
+        raise RVToolsValidationError("Die Datei ist keine lesbare Excel (xlsx) Datei: "+str(e))
+    finally:
+        uploaded_file.seek(0)
+
+    missing_columns = {}
+    column_mapping = {}
+    for sheet_name, cells in header_cells.items():
+        header = [(shared_strings.get(int(cell_value)) if cell_type == 's' else cell_value) for cell_type, cell_value in cells if cell_value is not None]
+        header = [str(column) for column in header if column is not None]
+
+        # Raw header text is the key (pandas matches usecols against it), names are compared without surrounding whitespace
+        # Exact column names win over aliases
+        sheet_cols_to_use = cols_to_use[sheet_name] + optional_cols_to_use.get(sheet_name, [])
+        sheet_mapping = {}
+        for column in header:
+            if column.strip() in sheet_cols_to_use and column.strip() not in sheet_mapping.values():
+                sheet_mapping[column] = column.strip()
+        for column in header:
+            if column_aliases.get(column.strip()) in sheet_cols_to_use and column_aliases[column.strip()] not in sheet_mapping.values():
+                sheet_mapping[column] = column_aliases[column.strip()]
+        column_mapping[sheet_name] = sheet_mapping
+
+        sheet_missing_columns = [column for column in cols_to_use[sheet_name] if column not in sheet_mapping.values()]
+        if sheet_missing_columns:
+            missing_columns[sheet_name] = sheet_missing_columns
+
+    validation_result = {
+        'valid': not missing_sheets and not missing_columns,
+        'missing_sheets': missing_sheets,
+        'missing_columns': missing_columns,
+        'column_mapping': column_mapping,
+    }
+
+    return validation_result
+
+# Generate host -> cluster and datastore -> cluster index once per upload
+# Datastores are mapped via their connected hosts (vDatastore "Hosts"), a datastore shared by several clusters belongs to all of them
+@st.cache(allow_output_mutation=True)
+def generate_datastore_cluster_index(df_vHosts, df_vInfo, df_vDataStore):
+
+    host_cluster_df = pd.concat([df_vHosts[['Host', 'Cluster']], df_vInfo[['Host', 'Cluster']]]).dropna().drop_duplicates(subset=['Host'])
+    host_to_cluster = dict(zip(host_cluster_df['Host'], host_cluster_df['Cluster']))
+    clusters = np.array(sorted(host_cluster_df['Cluster'].unique()))
+    cluster_position = {cluster: position for position, cluster in enumerate(clusters)}
+
+    datastore_cluster_matrix = np.zeros((df_vDataStore.shape[0], len(clusters)), dtype=bool)
+    hosts_available = 'Hosts' in df_vDataStore.columns
+    if hosts_available:
+        for datastore_position, datastore_hosts in enumerate(df_vDataStore['Hosts'].fillna('').astype(str)):
+            for host in datastore_hosts.split(','):
+                cluster = host_to_cluster.get(host.strip())
+                if cluster is not None:
+                    datastore_cluster_matrix[datastore_position, cluster_position[cluster]] = True
+
+    datastore_cluster_index = {
+        'host_to_cluster': host_to_cluster,
+        'clusters': clusters,
+        'datastore_cluster_matrix': datastore_cluster_matrix,
+        'available': hosts_available,
+    }
+
+    return datastore_cluster_index
+
+# Filter vDatastore by selected clusters via index lookup - without host information all datastores are returned
+def filter_datastores_by_cluster(df_vDataStore, datastore_cluster_index, vCluster_selected):
+
+    if not datastore_cluster_index['available']:
+        return df_vDataStore
+
+    cluster_mask = np.isin(datastore_cluster_index['clusters'], list(vCluster_selected))
+    datastore_mask = datastore_cluster_index['datastore_cluster_matrix'][:, cluster_mask].any(axis=1)
+
+    return df_vDataStore.iloc[np.flatnonzero(datastore_mask)]
 
 # Generate pCPU, pMemory & vDatastore information for vCluster section
 def generate_donut_charts(usage_percentage):
@@ -107,7 +833,7 @@ def generate_Storage_infos(df_vDataStore):
     storage_consumed = df_vDataStore['In Use MiB'].sum() / 1048576 # convert to TiB
     storage_provisioned = df_vDataStore['Provisioned MiB'].sum() / 1048576 # convert to TiB
 
-    storage_percentage_temp = storage_consumed / storage_provisioned * 100
+    storage_percentage_temp = storage_consumed / storage_provisioned * 100 if storage_provisioned > 0 else 0
     storage_percentage = [storage_percentage_temp, storage_provisioned]
 
     return  round(storage_provisioned,2), round(storage_consumed,2), storage_percentage
@@ -184,22 +910,88 @@ def generate_top10_vStorage_consumed_VMs_df(df_vmList_filtered):
 
     return top_vms_vStorage_consumed
 
+# Classify a single guest OS string into (family, version, licensing) based on the rule set
+def classify_guest_os(os_name, rules=guest_os_rules):
+
+    for pattern, family, licensing in rules:
+        match = re.search(pattern, os_name, flags=re.IGNORECASE)
+        if match:
+            version = match.groupdict().get('version') or ''
+            return family, version, licensing
+
+    return 'Sonstige', '', 'Unbekannt'
+
+# Classify a guest OS column - classifier runs once per unique OS string and is mapped back via categorical codes
+def classify_guest_os_series(os_series, rules=guest_os_rules):
+
+    os_categorical = os_series.astype('category')
+    os_classified = [classify_guest_os(str(os_name), rules) for os_name in os_categorical.cat.categories]
+    os_classified.append(('Unbekannt', '', 'Unbekannt')) # Last row used for VMs without OS information (code -1)
+    os_classified_df = pd.DataFrame(os_classified, columns=['Familie', 'Version', 'Lizenzierung'])
+
+    codes = os_categorical.cat.codes.to_numpy()
+    codes = np.where(codes < 0, len(os_classified) - 1, codes)
+    os_series_classified = os_classified_df.iloc[codes].reset_index(drop=True)
+    os_series_classified.index = os_series.index
+
+    return os_series_classified
+
+# Classify config file & VMware Tools guest OS of all VMs once per upload - shared by the guest OS tables, the reconciliation and the report
+# Filtered views select their rows by index (see select_guest_os_classification)
+@st.cache(allow_output_mutation=True, max_entries=guest_os_classification_cache_entries)
+def generate_guest_os_classification(df_vInfo, rules=guest_os_rules):
+
+    guest_os_config = classify_guest_os_series(df_vInfo['OS according to the configuration file'], rules)
+    guest_os_tools = classify_guest_os_series(df_vInfo['OS according to the VMware Tools'], rules)
+
+    return guest_os_config, guest_os_tools
+
+# Rows of the guest OS classification for filtered VMs (df_vInfo_filtered keeps the index of df_vInfo)
+def select_guest_os_classification(guest_os_classification, df_vInfo_filtered):
+
+    guest_os_config, guest_os_tools = guest_os_classification
+
+    return guest_os_config.loc[df_vInfo_filtered.index], guest_os_tools.loc[df_vInfo_filtered.index]
+
 # Generate Guest OS df
 @st.cache(allow_output_mutation=True)
-def generate_guest_os_df(df_vInfo_filtered):
+def generate_guest_os_df(df_vInfo_filtered, guest_os_classification):
 
-    guest_os_df_config = df_vInfo_filtered['OS according to the configuration file'].value_counts()
-    guest_os_df_config = guest_os_df_config.reset_index()
-    guest_os_df_config.rename(columns={'index': ''}, inplace=True)
-    guest_os_df_config.rename(columns={'OS according to the configuration file': 'Guest OS'}, inplace=True) # Rename Column
+    # VMs without OS information are not counted (same as value_counts before)
+    guest_os_config, guest_os_tools = select_guest_os_classification(guest_os_classification, df_vInfo_filtered)
+    guest_os_config = guest_os_config[df_vInfo_filtered['OS according to the configuration file'].notna()]
+    guest_os_df_config = guest_os_config.groupby(['Familie', 'Version', 'Lizenzierung']).size().reset_index(name='Anzahl VMs')
+    guest_os_df_config = guest_os_df_config.sort_values(['Familie', 'Anzahl VMs'], ascending=[True, False]).reset_index(drop=True)
 
-    guest_os_df_tools = df_vInfo_filtered['OS according to the VMware Tools'].value_counts()
-    guest_os_df_tools = guest_os_df_tools.reset_index()
-    guest_os_df_tools.rename(columns={'index': ''}, inplace=True)
-    guest_os_df_tools.rename(columns={'OS according to the VMware Tools': 'Guest OS'}, inplace=True) # Rename Column
+    guest_os_tools = guest_os_tools[df_vInfo_filtered['OS according to the VMware Tools'].notna()]
+    guest_os_df_tools = guest_os_tools.groupby(['Familie', 'Version', 'Lizenzierung']).size().reset_index(name='Anzahl VMs')
+    guest_os_df_tools = guest_os_df_tools.sort_values(['Familie', 'Anzahl VMs'], ascending=[True, False]).reset_index(drop=True)
 
     return guest_os_df_config, guest_os_df_tools
 
+# Generate Guest OS reconciliation df - VMs where config file OS and VMware Tools OS disagree
+@st.cache(allow_output_mutation=True)
+def generate_guest_os_mismatch_df(df_vInfo_filtered, guest_os_classification):
+
+    guest_os_config, guest_os_tools = select_guest_os_classification(guest_os_classification, df_vInfo_filtered)
+
+    # Only compare VMs with VMware Tools information, version only if both sides provide one and config file is not "or later"
+    tools_available = df_vInfo_filtered['OS according to the VMware Tools'].notna()
+    config_or_later = df_vInfo_filtered['OS according to the configuration file'].astype('string').str.contains('or later', case=False, na=False)
+    family_mismatch = guest_os_config['Familie'] != guest_os_tools['Familie']
+    version_mismatch = (guest_os_config['Version'] != '') & (guest_os_tools['Version'] != '') & (guest_os_config['Version'] != guest_os_tools['Version']) & ~config_or_later
+    mismatch = tools_available & (family_mismatch | version_mismatch)
+
+    guest_os_mismatch_df = pd.DataFrame({
+            'VM': df_vInfo_filtered.loc[mismatch, 'VM'],
+            'OS Configurations-File': df_vInfo_filtered.loc[mismatch, 'OS according to the configuration file'],
+            'OS VMware Tools': df_vInfo_filtered.loc[mismatch, 'OS according to the VMware Tools'],
+            'Familie (Config)': guest_os_config.loc[mismatch, 'Familie'],
+            'Familie (Tools)': guest_os_tools.loc[mismatch, 'Familie'],
+        }).reset_index(drop=True)
+
+    return guest_os_mismatch_df
+
 # Generate vHost Overview Section
 @st.cache(allow_output_mutation=True)
 def generate_vRAM_overview_df(df_vMemory_filtered):
@@ -322,7 +1114,10 @@ def generate_vStorage_overview_df(df_vDisk_filtered,df_vPartition_filtered,df_vD
     vDataStore_capacity = str(round(df_vDataStore['Capacity MiB'].sum() / 1048576,2))+" TiB"
     vDataStore_provisioned = str(round(df_vDataStore['Provisioned MiB'].sum() / 1048576,2))+" TiB"
     vDataStore_in_use = str(round(df_vDataStore['In Use MiB'].sum() / 1048576,2))+" TiB"
-    vDataStore_free_percentage = str(int((1-(round(df_vDataStore['In Use MiB'].sum() / df_vDataStore['Provisioned MiB'].sum(),2)))*100))+' %'
+    if df_vDataStore['Provisioned MiB'].sum() > 0: # no datastore connected to the selected clusters
+        vDataStore_free_percentage = str(int((1-(round(df_vDataStore['In Use MiB'].sum() / df_vDataStore['Provisioned MiB'].sum(),2)))*100))+' %'
+    else:
+        vDataStore_free_percentage = 'nicht vorhanden'
     vDataStore_first_column_df = {'': ["Anzahl vDatastores", "Capacity", "Provisioned","In Use", "Free"]}
     vDataStore_df = pd.DataFrame(vDataStore_first_column_df)
     vDataStore_second_column_df = [
@@ -395,16 +1190,61 @@ def generate_vStorage_overview_df(df_vDisk_filtered,df_vPartition_filtered,df_vD
 
     return vPartition_df, vDisk_df,vDataStore_df, vm_storage_df, vInfo_df
 
+# Bin a metric once per upload into per cluster x powerstate count arrays
+# Without bins every distinct value is its own bin, with bins the intervals are (left, right] and the lowest edge is included (like pd.cut)
+@st.cache(allow_output_mutation=True)
+def generate_histogram_index(df, value_column, bins=None, value_divisor=1):
+
+    values = (df[value_column].to_numpy(dtype=float) / value_divisor)
+    cluster_categorical = df['Cluster'].astype('category')
+    powerstate_categorical = df['Powerstate'].astype('category')
+
+    if bins is None:
+        valid_values = values[~np.isnan(values)]
+        bin_edges = np.unique(valid_values)
+        bin_idx = np.searchsorted(bin_edges, values)
+        in_range = ~np.isnan(values)
+    else:
+        bin_edges = np.asarray(bins, dtype=float)
+        bin_idx = np.searchsorted(bin_edges, values, side='left') - 1
+        bin_idx[values == bin_edges[0]] = 0
+        in_range = (values >= bin_edges[0]) & (values <= bin_edges[-1])
+    bin_amount = len(bin_edges) if bins is None else len(bin_edges) - 1
+
+    cluster_codes = cluster_categorical.cat.codes.to_numpy()
+    powerstate_codes = powerstate_categorical.cat.codes.to_numpy()
+    cluster_amount = len(cluster_categorical.cat.categories)
+    powerstate_amount = len(powerstate_categorical.cat.categories)
+
+    # Rows without cluster / powerstate or outside of bins are not counted (same as query & pd.cut before)
+    valid = in_range & (cluster_codes >= 0) & (powerstate_codes >= 0)
+    flat_idx = (cluster_codes[valid] * powerstate_amount + powerstate_codes[valid]) * bin_amount + bin_idx[valid]
+    counts = np.bincount(flat_idx, minlength=cluster_amount * powerstate_amount * bin_amount).reshape(cluster_amount, powerstate_amount, bin_amount)
+
+    histogram_index = {
+        'clusters': np.asarray(cluster_categorical.cat.categories),
+        'powerstates': np.asarray(powerstate_categorical.cat.categories),
+        'bin_values': bin_edges if bins is None else bin_edges[1:],
+        'counts': counts,
+    }
+
+    return histogram_index
+
+# Sum the precomputed histogram for the selected clusters (and optional powerstates)
+def select_histogram(histogram_index, vCluster_selected, powerstates_selected=None):
+
+    cluster_mask = np.isin(histogram_index['clusters'], list(vCluster_selected))
+    counts = histogram_index['counts'][cluster_mask]
+    if powerstates_selected is not None:
+        counts = counts[:, np.isin(histogram_index['powerstates'], list(powerstates_selected))]
+
+    return counts.sum(axis=(0, 1))
+
 # Generate vDisk bar chart diagram in vStorage section
 @st.cache(allow_output_mutation=True)
-def generate_vDisk_bar_chart(df_vDisk_filtered):
-
-    vDisk_df = pd.DataFrame()
-    vDisk_df["Capacity GiB"] = df_vDisk_filtered["Capacity MiB"] / 1024
-    bins = [0, 10.01, 100.01, 1024.01,2048.01, 4096.01, 63488.01] # As lower end will be included in bin added .01 to ensure correct bins
-    labels = ['0 - 10 GB', '>10 - 100 GB', '>100 GB - 1 TB', '>1 TB - 2 TB', '>2 TB - 4TB', '> 4 TB']
-    vDisk_df['label'] = pd.cut(vDisk_df['Capacity GiB'], bins=bins, labels=labels, include_lowest=True)
-    vDisk_df = vDisk_df.groupby('label').size().reset_index(name='counts')
+def generate_vDisk_bar_chart(vDisk_histogram_index, vCluster_selected, labels=vDisk_histogram_labels):
+
+    vDisk_df = pd.DataFrame({'label': list(labels), 'counts': select_histogram(vDisk_histogram_index, vCluster_selected)})
     bar_chart = px.bar(
                 vDisk_df,
                 x = 'label',
@@ -443,35 +1283,46 @@ def generate_vm_storage_chart(vm_storage_df):
 
     return storage_chart, storage_chart_config
 
+# Calculate sizing basis, final value & growth for a growth percentage - vCPU basis is rounded up to full vCPUs
+def calculate_sizing_values(value, growth_percentage, round_up_basis=False):
+
+    basis_value = int(np.ceil(value)) if round_up_basis else round(value,2)
+    final_value = int(np.ceil(basis_value*(1+(int(growth_percentage)/100))))
+    growth_value = final_value-basis_value if round_up_basis else round((final_value-basis_value),2)
+
+    return basis_value, final_value, growth_value
+
+# Get sizing basis value for a sizing option from the overview tables
+def get_sizing_basis_value(sizing_type, sizing_option, vCPU_provisioned_df, vRAM_provisioned_df, vm_storage_df):
+
+    row = sizing_options[sizing_type][sizing_option]
+    if sizing_type == 'vCPU':
+        return vCPU_provisioned_df.data.loc[row].values[1]
+    elif sizing_type == 'vRAM':
+        return vRAM_provisioned_df.data.loc[row].values[1]
+
+    return float(vm_storage_df.iloc[row]['Werte'].strip(' TiB'))
+
 # Calculate vCPU Sizing Results
 # Do not use @st.cache here
 def calculate_sizing_result_vCPU(vCPU_provisioned_df):
 
-    if st.session_state['vCPU_selectbox'] == 'vCPUs VMs - On *':
-        vCPU_value = vCPU_provisioned_df.data.loc[0].values[1]
-    elif st.session_state['vCPU_selectbox'] == 'vCPUs VMs - Total (On/Off/Suspended)':
-        vCPU_value = vCPU_provisioned_df.data.loc[3].values[1]
+    vCPU_value = get_sizing_basis_value('vCPU', st.session_state['vCPU_selectbox'], vCPU_provisioned_df, None, None)
 
     # Roundup both values and convert to int
-    vCPU_value = int(np.ceil(vCPU_value))
-    vCPU_value_calc = int(np.ceil(vCPU_value*(1+(int(st.session_state['vCPU_slider'])/100))))
+    vCPU_value, vCPU_value_calc, vCPU_value_diff = calculate_sizing_values(vCPU_value, st.session_state['vCPU_slider'], round_up_basis=True)
 
     st.session_state['vCPU_basis'] = str(vCPU_value)
     st.session_state['vCPU_final'] = str(vCPU_value_calc)
-    st.session_state['vCPU_growth'] = str(vCPU_value_calc-vCPU_value)
+    st.session_state['vCPU_growth'] = str(vCPU_value_diff)
 
 # Calculate vRAM Sizing Results
 # Do not use @st.cache here
 def calculate_sizing_result_vRAM(vRAM_provisioned_df):
 
-    if st.session_state['vRAM_selectbox'] == 'vMemory VMs - On *':
-        vRAM_value = vRAM_provisioned_df.data.loc[0].values[1]
-    elif st.session_state['vRAM_selectbox'] == 'vMemory VMs - Total (On/Off/Suspended)':
-        vRAM_value = vRAM_provisioned_df.data.loc[3].values[1]
+    vRAM_value = get_sizing_basis_value('vRAM', st.session_state['vRAM_selectbox'], None, vRAM_provisioned_df, None)
 
-    vRAM_value = round(vRAM_value,2)
-    vRAM_value_calc = int(np.ceil(vRAM_value*(1+(int(st.session_state['vRAM_slider'])/100))))
-    vRAM_value_diff = round((vRAM_value_calc-vRAM_value),2)
+    vRAM_value, vRAM_value_calc, vRAM_value_diff = calculate_sizing_values(vRAM_value, st.session_state['vRAM_slider'])
 
     st.session_state['vRAM_basis'] = str(vRAM_value)
     st.session_state['vRAM_final'] = str(vRAM_value_calc)
@@ -481,19 +1332,10 @@ def calculate_sizing_result_vRAM(vRAM_provisioned_df):
 # Do not use @st.cache here
 def calculate_sizing_result_vStorage(vm_storage_df):
 
-    if st.session_state['vStorage_selectbox'] == 'Consumed VM Storage - Total (On/Off/Suspended) *':
-        vStorage_value = float(vm_storage_df.iloc[5]['Werte'].strip(' TiB'))
-    elif st.session_state['vStorage_selectbox'] == 'Consumed VM Storage - On':
-        vStorage_value = float(vm_storage_df.iloc[3]['Werte'].strip(' TiB'))
-    elif st.session_state['vStorage_selectbox'] == 'Provisioned VM Storage - Total (On/Off/Suspended)':
-        vStorage_value = float(vm_storage_df.iloc[8]['Werte'].strip(' TiB'))
-    elif st.session_state['vStorage_selectbox'] == 'Provisioned VM Storage - On':
-        vStorage_value = float(vm_storage_df.iloc[6]['Werte'].strip(' TiB'))
+    vStorage_value = get_sizing_basis_value('vStorage', st.session_state['vStorage_selectbox'], None, None, vm_storage_df)
 
     # Roundup values and convert to int
-    vStorage_value = round(vStorage_value,2)
-    vStorage_value_calc = int(np.ceil(vStorage_value*(1+(int(st.session_state['vStorage_slider'])/100))))
-    vStorage_value_diff = round((vStorage_value_calc-vStorage_value),2)
+    vStorage_value, vStorage_value_calc, vStorage_value_diff = calculate_sizing_values(vStorage_value, st.session_state['vStorage_slider'])
 
     st.session_state['vStorage_basis'] = str(vStorage_value)
     st.session_state['vStorage_final'] = str(vStorage_value_calc)
@@ -501,9 +1343,10 @@ def calculate_sizing_result_vStorage(vm_storage_df):
 
 # vCPU bar chart in the vCPU section
 @st.cache(allow_output_mutation=True)
-def generate_cpu_bar_chart(df_vCPU_filtered):
+def generate_cpu_bar_chart(vCPU_histogram_index, vCluster_selected):
 
-    df_test = df_vCPU_filtered.groupby('CPUs').size().reset_index(name='counts')
+    df_test = pd.DataFrame({'CPUs': vCPU_histogram_index['bin_values'].astype(int), 'counts': select_histogram(vCPU_histogram_index, vCluster_selected)})
+    df_test = df_test[df_test['counts'] > 0] # Only show values available in the selected clusters
     # Make Column as int then as str in order for xaxis to show only available values rather than gaps with missing values
     df_test['CPUs'] = df_test['CPUs'].astype(str) 
     bar_chart = px.bar(
@@ -526,9 +1369,10 @@ def generate_cpu_bar_chart(df_vCPU_filtered):
 
 # vMemory bar chart in the vMemory section
 @st.cache(allow_output_mutation=True)
-def generate_memory_bar_chart(df_vMemory_filtered):
+def generate_memory_bar_chart(vMemory_histogram_index, vCluster_selected):
     # Generate new df only with Size Mib / GiB and counts as columns
-    df_test = df_vMemory_filtered.groupby('Size MiB').size().reset_index(name='counts')
+    df_test = pd.DataFrame({'Size MiB': vMemory_histogram_index['bin_values'], 'counts': select_histogram(vMemory_histogram_index, vCluster_selected)})
+    df_test = df_test[df_test['counts'] > 0] # Only show values available in the selected clusters
     # Calculate from MiB to GiB & rename column
     df_test.loc[:,"Size MiB"] = df_test["Size MiB"] / 1024 # Use GiB instead of MiB
     df_test.rename(columns={'Size MiB': 'Size GiB'}, inplace=True) # Rename Column
@@ -551,6 +1395,397 @@ def generate_memory_bar_chart(df_vMemory_filtered):
 
     return bar_chart, bar_chart_config
 
+# Convert a table (DataFrame / Styler with label & value column) into a dict for JSON output
+def convert_table_to_dict(table):
+
+    table = table.data if hasattr(table, 'data') else table # Styler -> DataFrame
+
+    return {str(label): (None if pd.isna(value) else get_report_value(value)) for label, value in zip(table.iloc[:, 0], table.iloc[:, 1])}
+
+# Raised if selected clusters do not exist in the RVTools export
+class UnknownClusterError(ValueError):
+
+    def __init__(self, unknown_clusters, clusters):
+        super().__init__('Unknown cluster: '+', '.join(unknown_clusters))
+        self.clusters = clusters
+
+# Generate overview & sizing results without Streamlit page (used by the analysis service)
+def generate_analysis_result(frames, vCluster_selected=None, sizing_growth=None, sizing_selected=None):
+
+    df_vInfo, df_vCPU, df_vMemory, df_vDisk, df_vPartition, df_vHosts, df_vDataStore = frames
+    clusters = [str(cluster) for cluster in sorted(df_vHosts['Cluster'].dropna().unique())]
+    vCluster_selected = list(vCluster_selected) if vCluster_selected else clusters
+    unknown_clusters = [cluster for cluster in vCluster_selected if cluster not in clusters]
+    if unknown_clusters:
+        raise UnknownClusterError(unknown_clusters, clusters)
+    sizing_growth = dict(sizing_default_growth, **(sizing_growth or {}))
+    sizing_selected = dict({sizing_type: next(iter(options)) for sizing_type, options in sizing_options.items()}, **(sizing_selected or {}))
+
+    df_vHosts_filtered = df_vHosts.query("`Cluster`==@vCluster_selected")
+    df_vInfo_filtered = df_vInfo.query("`Cluster`==@vCluster_selected")
+    df_vCPU_filtered = df_vCPU.query("`Cluster`==@vCluster_selected")
+    df_vMemory_filtered = df_vMemory.query("`Cluster`==@vCluster_selected")
+    df_vDisk_filtered = df_vDisk.query("`Cluster`==@vCluster_selected")
+    df_vPartition_filtered = df_vPartition.query("`Cluster`==@vCluster_selected")
+    datastore_cluster_index = generate_datastore_cluster_index(df_vHosts, df_vInfo, df_vDataStore)
+    df_vDataStore_filtered = filter_datastores_by_cluster(df_vDataStore, datastore_cluster_index, vCluster_selected)
+
+    total_ghz, consumed_ghz, cpu_percentage = generate_CPU_infos(df_vHosts_filtered)
+    total_memory, consumed_memory, memory_percentage = generate_Memory_infos(df_vHosts_filtered)
+    storage_provisioned, storage_consumed, storage_percentage = generate_Storage_infos(df_vDataStore_filtered)
+    vCPU_provisioned_df = generate_vCPU_overview_df(df_vCPU_filtered, df_vHosts_filtered)
+    vRAM_provisioned_df = generate_vRAM_overview_df(df_vMemory_filtered)
+    vPartition_df, vDisk_df, vDataStore_df, vm_storage_df, vInfo_df = generate_vStorage_overview_df(df_vDisk_filtered, df_vPartition_filtered, df_vDataStore_filtered, df_vInfo_filtered)
+
+    sizing_result = {}
+    for sizing_type in sizing_options:
+        basis_value = get_sizing_basis_value(sizing_type, sizing_selected[sizing_type], vCPU_provisioned_df, vRAM_provisioned_df, vm_storage_df)
+        basis_value, final_value, growth_value = calculate_sizing_values(basis_value, sizing_growth[sizing_type], round_up_basis=(sizing_type == 'vCPU'))
+        sizing_result[sizing_type] = {
+            'basis': get_report_value(basis_value), 'final': get_report_value(final_value), 'growth': get_report_value(growth_value),
+            'growth_percentage': int(sizing_growth[sizing_type]), 'option': sizing_selected[sizing_type],
+            'unit': {'vCPU': 'vCPUs', 'vRAM': 'GiB', 'vStorage': 'TiB'}[sizing_type],
+        }
+
+    analysis_result = {
+        'clusters': clusters,
+        'clusters_selected': vCluster_selected,
+        'vCluster': {
+            'datacenter': int(df_vInfo_filtered['Datacenter'].nunique()), 'cluster': int(df_vInfo_filtered['Cluster'].nunique()),
+            'host': int(df_vInfo_filtered['Host'].nunique()), 'vm': int(df_vInfo_filtered.shape[0]),
+            'pCPU': {'total_ghz': get_report_value(total_ghz), 'consumed_ghz': get_report_value(consumed_ghz), 'usage_percentage': get_report_value(cpu_percentage[0])},
+            'pMemory': {'total_gib': get_report_value(total_memory), 'consumed_gib': get_report_value(consumed_memory), 'usage_percentage': get_report_value(memory_percentage[0])},
+            'vDatastore': {'provisioned_tib': get_report_value(storage_provisioned), 'consumed_tib': get_report_value(storage_consumed), 'usage_percentage': get_report_value(storage_percentage[0]), 'filtered_by_cluster': datastore_cluster_index['available']},
+        },
+        'vCPU': convert_table_to_dict(vCPU_provisioned_df),
+        'vRAM': convert_table_to_dict(vRAM_provisioned_df),
+        'vPartition': convert_table_to_dict(vPartition_df),
+        'vDisk': convert_table_to_dict(vDisk_df),
+        'vDatastore': convert_table_to_dict(vDataStore_df),
+        'vInfo': convert_table_to_dict(vInfo_df),
+        'vm_storage': convert_table_to_dict(vm_storage_df),
+        'sizing': sizing_result,
+    }
+
+    return analysis_result
+
+# Analysis job of the analysis service - frames are parsed via the shared parse scheduler (coalesced per content digest) and kept in analysis_frame_store
+# Without spooled_path only already stored frames are used (AnalysisFramesNotStoredError if evicted), each upload is its own session so only the process memory budget applies
+def run_analysis_job(spooled_path, upload_digest, vCluster_selected=None, sizing_growth=None, sizing_selected=None):
+
+    session_id = 'service-'+upload_digest
+    frames = get_stored_analysis_frames(get_analysis_frames_key(upload_digest, derive_vCPU_vMemory_from_vInfo), session_id)
+    if frames is None:
+        if spooled_path is None:
+            raise AnalysisFramesNotStoredError(upload_digest)
+        with open_mapped_file(spooled_path) as mapped_file:
+            frames = load_analysis_frames(mapped_file, session_id, upload_digest=upload_digest)
+
+    analysis_result = generate_analysis_result(frames, vCluster_selected, sizing_growth, sizing_selected)
+    analysis_result['digest'] = upload_digest
+
+    return analysis_result
+
+# Generate sizing result df from session state (calculate_sizing_result_* must have run before)
+def generate_sizing_result_df():
+
+    sizing_result_df = pd.DataFrame({
+        '': ['vCPU', 'vRAM', 'vStorage'],
+        'Ausgangswert': [st.session_state['vCPU_basis'], st.session_state['vRAM_basis'], st.session_state['vStorage_basis']],
+        'Wachstum': [st.session_state['vCPU_growth'], st.session_state['vRAM_growth'], st.session_state['vStorage_growth']],
+        'Endwert': [st.session_state['vCPU_final'], st.session_state['vRAM_final'], st.session_state['vStorage_final']],
+        'Einheit': ['vCPUs', 'GiB', 'TiB'],
+    })
+
+    return sizing_result_df
+
+# Yield a per VM detail sheet in row chunks - build_chunk(start, stop) builds the rows start:stop
+def generate_row_chunks(row_amount, build_chunk, chunk_size=vm_detail_chunk_size):
+
+    for start in range(0, row_amount, chunk_size):
+        yield build_chunk(start, min(start + chunk_size, row_amount))
+
+# Per VM detail sheets for the report export (vCPU, vRAM, storage source, OS): sheet name -> (columns, function returning a generator of row chunks)
+# Rows are only built chunk by chunk while a writer consumes them, the guest OS classification is the one of the page
+def generate_vm_detail_sheets(df_vInfo_filtered, df_vCPU_filtered, df_vMemory_filtered, df_vDisk_filtered, df_vPartition_filtered, guest_os_classification):
+
+    def vCPU_chunks():
+        yield from generate_row_chunks(df_vCPU_filtered.shape[0], lambda start, stop: df_vCPU_filtered.iloc[start:stop][['VM', 'Powerstate', 'Cluster', 'CPUs']])
+
+    def vRAM_chunks():
+        def build_chunk(start, stop):
+            df_chunk = df_vMemory_filtered.iloc[start:stop]
+            vRAM_chunk_df = df_chunk[['VM', 'Powerstate', 'Cluster']].copy()
+            vRAM_chunk_df['Size GiB'] = df_chunk['Size MiB'] / 1024
+            return vRAM_chunk_df
+        yield from generate_row_chunks(df_vMemory_filtered.shape[0], build_chunk)
+
+    # Same logic as VM Storage Auswertung: vPartition if available, otherwise vDisk (consumed = 80% of vDisk capacity)
+    def vStorage_chunks():
+        vPartition_per_vm = df_vPartition_filtered.groupby('VM ID')[['Capacity MiB', 'Consumed MiB']].sum()
+        vDisk_per_vm = df_vDisk_filtered.groupby('VM ID')['Capacity MiB'].sum()
+        def build_chunk(start, stop):
+            df_chunk = df_vInfo_filtered.iloc[start:stop]
+            vPartition_capacity = vPartition_per_vm['Capacity MiB'].reindex(df_chunk['VM ID']).to_numpy()
+            vPartition_consumed = vPartition_per_vm['Consumed MiB'].reindex(df_chunk['VM ID']).to_numpy()
+            vDisk_capacity = vDisk_per_vm.reindex(df_chunk['VM ID']).to_numpy()
+            has_vPartition = ~np.isnan(vPartition_capacity)
+            has_vDisk = ~np.isnan(vDisk_capacity)
+            vStorage_chunk_df = df_chunk[['VM', 'Powerstate', 'Cluster']].copy()
+            vStorage_chunk_df['Quelle'] = np.where(has_vPartition, 'vPartition', np.where(has_vDisk, 'vDisk', '-'))
+            vStorage_chunk_df['Provisioned GiB'] = np.where(has_vPartition, vPartition_capacity, vDisk_capacity) / 1024
+            vStorage_chunk_df['Consumed GiB'] = np.where(has_vPartition, vPartition_consumed, vDisk_capacity * 0.8) / 1024
+            return vStorage_chunk_df
+        yield from generate_row_chunks(df_vInfo_filtered.shape[0], build_chunk)
+
+    # Classification based on VMware Tools if available, otherwise on config file
+    def guest_os_chunks():
+        guest_os_config, guest_os_tools = select_guest_os_classification(guest_os_classification, df_vInfo_filtered)
+        def build_chunk(start, stop):
+            df_chunk = df_vInfo_filtered.iloc[start:stop]
+            guest_os_chunk_df = df_chunk[['VM', 'Powerstate', 'Cluster', 'OS according to the configuration file', 'OS according to the VMware Tools']].copy()
+            tools_available = df_chunk['OS according to the VMware Tools'].notna().to_numpy()
+            guest_os_classified = guest_os_config.iloc[start:stop].copy()
+            guest_os_classified.loc[tools_available] = guest_os_tools.iloc[start:stop].loc[tools_available]
+            guest_os_chunk_df[['Familie', 'Version', 'Lizenzierung']] = guest_os_classified
+            return guest_os_chunk_df
+        yield from generate_row_chunks(df_vInfo_filtered.shape[0], build_chunk)
+
+    vm_detail_sheets = {
+        'VM vCPU': (['VM', 'Powerstate', 'Cluster', 'CPUs'], vCPU_chunks),
+        'VM vRAM': (['VM', 'Powerstate', 'Cluster', 'Size GiB'], vRAM_chunks),
+        'VM vStorage': (['VM', 'Powerstate', 'Cluster', 'Quelle', 'Provisioned GiB', 'Consumed GiB'], vStorage_chunks),
+        'VM Gastbetriebssystem': (['VM', 'Powerstate', 'Cluster', 'OS according to the configuration file', 'OS according to the VMware Tools', 'Familie', 'Version', 'Lizenzierung'], guest_os_chunks),
+    }
+
+    return vm_detail_sheets
+
+# Convert a value for the report (NaN -> empty, numpy -> python)
+def get_report_value(value):
+
+    if value is None or (isinstance(value, float) and np.isnan(value)):
+        return ''
+    if isinstance(value, np.generic):
+        return value.item()
+
+    return value
+
+# Export report as xlsx - per VM sheets are written chunk by chunk in constant memory mode (rows are flushed to disk)
+def export_report_xlsx(report_path, report_tables, sizing_result_df, vm_detail_sheets):
+
+    workbook = xlsxwriter.Workbook(report_path, {'constant_memory': True, 'nan_inf_to_errors': True})
+    title_format = workbook.add_format({'bold': True, 'font_color': '#034EA2', 'font_size': 12})
+    header_format = workbook.add_format({'bold': True, 'bg_color': '#BBE3F3'})
+
+    def write_rows(worksheet, row, table):
+        for row_values in table.itertuples(index=False, name=None):
+            worksheet.write_row(row, 0, [get_report_value(value) for value in row_values])
+            row += 1
+        return row
+
+    def write_table(worksheet, row, table):
+        table = table.data if hasattr(table, 'data') else table # Styler -> DataFrame
+        worksheet.write_row(row, 0, [str(column) for column in table.columns], header_format)
+        return write_rows(worksheet, row + 1, table)
+
+    sizing_worksheet = workbook.add_worksheet('Sizing')
+    sizing_worksheet.write(0, 0, 'Sizing-Eckdaten-Ergebnis', title_format)
+    write_table(sizing_worksheet, 1, sizing_result_df)
+
+    overview_worksheet = workbook.add_worksheet('Übersicht')
+    overview_worksheet.set_column(0, 0, 40)
+    overview_worksheet.set_column(1, 5, 20)
+    row = 0
+    for title, table in report_tables.items():
+        overview_worksheet.write(row, 0, title, title_format)
+        row = write_table(overview_worksheet, row + 1, table) + 1
+
+    for sheet_name, (columns, vm_detail_chunks) in vm_detail_sheets.items():
+        vm_detail_worksheet = workbook.add_worksheet(sheet_name)
+        vm_detail_worksheet.set_column(0, len(columns) - 1, 20)
+        vm_detail_worksheet.write_row(0, 0, columns, header_format)
+        row = 1
+        for vm_detail_chunk_df in vm_detail_chunks():
+            row = write_rows(vm_detail_worksheet, row, vm_detail_chunk_df)
+
+    workbook.close()
+
+# Export report as self-contained html - per VM tables are streamed chunk by chunk to the file
+def export_report_html(report_path, report_tables, sizing_result_df, vm_detail_sheets):
+
+    def write_table_chunks(report_file, columns, chunks):
+        report_file.write('<table><thead><tr>'+''.join('<th>'+html.escape(str(column))+'</th>' for column in columns)+'</tr></thead><tbody>\n')
+        for chunk in chunks:
+            for row_values in chunk.itertuples(index=False, name=None):
+                report_file.write('<tr>'+''.join('<td>'+html.escape(str(get_report_value(value)))+'</td>' for value in row_values)+'</tr>\n')
+        report_file.write('</tbody></table>\n')
+
+    def write_table(report_file, table):
+        table = table.data if hasattr(table, 'data') else table # Styler -> DataFrame
+        write_table_chunks(report_file, table.columns, [table])
+
+    with open(report_path, 'w', encoding='utf-8') as report_file:
+        report_file.write('<!DOCTYPE html><html><head><meta charset="utf-8"><title>RVTools Analyse</title><style>')
+        report_file.write('body{font-family:sans-serif;color:#000000;} h1,h2,h3{color:#034ea2;} table{border-collapse:collapse;margin-bottom:20px;} th{background:#BBE3F3;text-align:left;} th,td{border:1px solid #CCCCCC;padding:2px 8px;}')
+        report_file.write('</style></head><body>\n<h1>RVTools Analyse</h1>\n<p>Erstellt am '+datetime.now().strftime("%d.%m.%Y %H:%M")+'</p>\n')
+
+        report_file.write('<h2>Sizing-Eckdaten-Ergebnis</h2>\n')
+        write_table(report_file, sizing_result_df)
+
+        report_file.write('<h2>Auswertung</h2>\n')
+        for title, table in report_tables.items():
+            report_file.write('<h3>'+html.escape(title)+'</h3>\n')
+            write_table(report_file, table)
+
+        for sheet_name, (columns, vm_detail_chunks) in vm_detail_sheets.items():
+            report_file.write('<h2>'+html.escape(sheet_name)+'</h2>\n')
+            write_table_chunks(report_file, columns, vm_detail_chunks())
+
+        report_file.write('</body></html>\n')
+
+# Read creation date of the RVTools export from the xlsx document properties (today if not available)
+def read_xlsx_creation_date(uploaded_file):
+
+    creation_date = datetime.now().date()
+    try:
+        uploaded_file.seek(0)
+        with zipfile.ZipFile(uploaded_file) as xlsx_zip:
+            core_root = ET.fromstring(xlsx_zip.read('docProps/core.xml'))
+        created = core_root.find('{http://purl.org/dc/terms/}created')
+        if created is not None and created.text:
+            creation_date = datetime.strptime(created.text[:10], '%Y-%m-%d').date()
+    except (KeyError, ValueError, zipfile.BadZipFile):
+        pass
+    uploaded_file.seek(0)
+
+    return creation_date
+
+# Generate per cluster capacity aggregates for the history based on the overview calculations
+@st.cache(allow_output_mutation=True)
+def generate_cluster_capacity_df(df_vInfo, df_vCPU, df_vMemory, df_vDisk, df_vPartition, df_vHosts, df_vDataStore):
+
+    cluster_capacity = []
+    for cluster in sorted(df_vHosts['Cluster'].dropna().unique()):
+        df_vInfo_cluster = df_vInfo.query("`Cluster`==@cluster")
+        vCPU_provisioned_df = generate_vCPU_overview_df(df_vCPU.query("`Cluster`==@cluster"), df_vHosts.query("`Cluster`==@cluster"))
+        vRAM_provisioned_df = generate_vRAM_overview_df(df_vMemory.query("`Cluster`==@cluster"))
+        vm_storage_df = generate_vStorage_overview_df(df_vDisk.query("`Cluster`==@cluster"), df_vPartition.query("`Cluster`==@cluster"), df_vDataStore, df_vInfo_cluster)[3]
+        cluster_capacity.append({
+            'cluster': cluster,
+            'vm_amount': df_vInfo_cluster.shape[0],
+            'vcpu_on': float(vCPU_provisioned_df.data.loc[0].values[1]),
+            'vcpu_total': float(vCPU_provisioned_df.data.loc[3].values[1]),
+            'vram_on_gib': float(vRAM_provisioned_df.data.loc[0].values[1]),
+            'vram_total_gib': float(vRAM_provisioned_df.data.loc[3].values[1]),
+            'storage_consumed_on_tib': float(vm_storage_df.iloc[3]['Werte'].strip(' TiB')),
+            'storage_consumed_total_tib': float(vm_storage_df.iloc[5]['Werte'].strip(' TiB')),
+            'storage_provisioned_on_tib': float(vm_storage_df.iloc[6]['Werte'].strip(' TiB')),
+            'storage_provisioned_total_tib': float(vm_storage_df.iloc[8]['Werte'].strip(' TiB')),
+        })
+
+    return pd.DataFrame(cluster_capacity)
+
+# Open history database and create schema if needed - trend queries use the (customer, cluster, export_date) index
+def open_history_db(db_path=history_db_path):
+
+    if os.path.dirname(db_path):
+        os.makedirs(os.path.dirname(db_path), exist_ok=True)
+    connection = sqlite3.connect(db_path)
+    connection.execute(
+        "CREATE TABLE IF NOT EXISTS cluster_capacity ("
+        "customer TEXT NOT NULL, export_digest TEXT NOT NULL, export_date TEXT NOT NULL, cluster TEXT NOT NULL, vm_amount INTEGER, "
+        + ''.join(metric+' REAL, ' for metric in history_metrics) +
+        "PRIMARY KEY (customer, export_digest, cluster))"
+    )
+    connection.execute("CREATE INDEX IF NOT EXISTS cluster_capacity_trend ON cluster_capacity (customer, cluster, export_date)")
+
+    return connection
+
+# Store per cluster aggregates of one RVTools export - storing the same export again replaces it
+def store_cluster_capacity(customer, export_date, export_digest, cluster_capacity_df, db_path=history_db_path):
+
+    columns = ['customer', 'export_digest', 'export_date', 'cluster', 'vm_amount'] + list(history_metrics)
+    rows = [
+        [customer, export_digest, str(export_date), row['cluster'], int(row['vm_amount'])] + [float(row[metric]) for metric in history_metrics]
+        for row in cluster_capacity_df.to_dict('records')
+    ]
+    with closing(open_history_db(db_path)) as connection:
+        with connection:
+            connection.executemany(
+                "INSERT OR REPLACE INTO cluster_capacity ("+', '.join(columns)+") VALUES ("+', '.join('?' * len(columns))+")",
+                rows
+            )
+
+# Query first & last export date stored for a customer - None if nothing is stored (database is not created by reading)
+def query_capacity_date_range(customer, db_path=history_db_path):
+
+    if not os.path.exists(db_path):
+        return None
+    with closing(open_history_db(db_path)) as connection:
+        date_from, date_to = connection.execute("SELECT MIN(export_date), MAX(export_date) FROM cluster_capacity WHERE customer = ?", (customer,)).fetchone()
+    if date_from is None:
+        return None
+
+    return datetime.strptime(date_from, '%Y-%m-%d').date(), datetime.strptime(date_to, '%Y-%m-%d').date()
+
+# Query capacity trend (sum over the selected clusters per export) for a customer and optional date range
+def query_capacity_trend(customer, clusters, date_from=None, date_to=None, db_path=history_db_path):
+
+    if not os.path.exists(db_path): # nothing stored yet - do not create the database by reading
+        return pd.DataFrame(columns=['export_date', 'export_digest', 'vm_amount'] + list(history_metrics))
+
+    clusters = list(clusters) or [''] # IN () is not valid SQL
+    sql = (
+        "SELECT export_date, export_digest, SUM(vm_amount) AS vm_amount, "
+        + ', '.join('SUM('+metric+') AS '+metric for metric in history_metrics) +
+        " FROM cluster_capacity WHERE customer = ? AND cluster IN ("+', '.join('?' * len(clusters))+")"
+        " AND export_date >= ? AND export_date <= ? GROUP BY export_date, export_digest ORDER BY export_date"
+    )
+    params = [customer] + clusters + [str(date_from or '0000-01-01'), str(date_to or '9999-12-31')]
+    with closing(open_history_db(db_path)) as connection:
+        trend_df = pd.read_sql_query(sql, connection, params=params)
+
+    return trend_df
+
+# Forecast growth in % over forecast_years per metric based on a linear trend (None if less than 2 export dates)
+def generate_growth_forecast(trend_df, years=forecast_years):
+
+    growth_forecast = {}
+    export_days = (pd.to_datetime(trend_df['export_date']) - pd.to_datetime(trend_df['export_date']).min()).dt.days.to_numpy(dtype=float)
+    for metric in history_metrics:
+        values = trend_df[metric].to_numpy(dtype=float)
+        growth_forecast[metric] = None
+        if len(np.unique(export_days)) < 2:
+            continue
+        slope, intercept = np.polyfit(export_days, values, 1)
+        current_value = slope * export_days.max() + intercept
+        if current_value <= 0:
+            continue
+        forecast_value = slope * (export_days.max() + 365 * years) + intercept
+        growth_forecast[metric] = int(np.clip(round((forecast_value / current_value - 1) * 100), 0, 100)) # same range as sizing sliders
+
+    return growth_forecast
+
+# Pre-populate sizing sliders with forecasted growth - must run before the sliders are created
+def apply_growth_forecast(growth_forecast):
+
+    for selectbox_key, slider_key, default_option in [('vCPU_selectbox', 'vCPU_slider', 'vCPUs VMs - On *'), ('vRAM_selectbox', 'vRAM_slider', 'vMemory VMs - On *'), ('vStorage_selectbox', 'vStorage_slider', 'Consumed VM Storage - Total (On/Off/Suspended) *')]:
+        growth = growth_forecast.get(sizing_history_metrics[st.session_state.get(selectbox_key, default_option)])
+        if growth is not None:
+            st.session_state[slider_key] = growth
+
+# Capacity trend chart for vCPU, vRAM & vStorage
+def generate_capacity_trend_chart(trend_df):
+
+    trend_chart = make_subplots(rows=1, cols=3, subplot_titles=('vCPUs', 'vRAM GiB', 'vStorage TiB'))
+    for column, metrics in enumerate([('vcpu_on', 'vcpu_total'), ('vram_on_gib', 'vram_total_gib'), ('storage_consumed_total_tib', 'storage_provisioned_total_tib')], start=1):
+        for metric, color in zip(metrics, ['#034EA2', '#B0D235']):
+            trend_chart.add_trace(go.Scatter(x=trend_df['export_date'], y=trend_df[metric], name=history_metric_labels[metric], mode='lines+markers', marker_color=color), row=1, col=column)
+    trend_chart.update_layout(margin=dict(l=10, r=10, t=30, b=10,pad=4), autosize=True, height = 300, showlegend=True)
+    trend_chart_config = { 'staticPlot': True}
+
+    return trend_chart, trend_chart_config
+
 # Send Slack Message
 # NO cache function!
 def send_slack_message_and_set_session_state(payload, uploaded_file):
@@ -0,0 +1,28 @@
+import argparse
+import glob
+import os
+import warnings
+import custom_functions
+
+######################
+# Import existing RVTools exports into the capacity history
+# Usage (from the repository root, custom_functions loads images/ relative to the working directory):
+#   python history_import.py --customer "Kunde" exports/*.xlsx
+######################
+if __name__ == '__main__':
+    warnings.simplefilter("ignore") # Ignore openpyxl Excile File Warning while reading (no default style)
+
+    parser = argparse.ArgumentParser(description='Import RVTools exports into the capacity history.')
+    parser.add_argument('--customer', required=True, help='Customer name used in the history')
+    parser.add_argument('--db', default=custom_functions.history_db_path, help='Path of the history SQLite database')
+    parser.add_argument('files', nargs='+', help='RVTools xlsx exports (glob patterns allowed)')
+    args = parser.parse_args()
+
+    for file_name in sorted(set(path for pattern in args.files for path in glob.glob(pattern))):
+        with open(file_name, 'rb') as export_file:
+            export_date = custom_functions.read_xlsx_creation_date(export_file)
+            export_digest = custom_functions.calculate_upload_digest(export_file)
+            frames = custom_functions.get_data_from_excel(export_file)
+        cluster_capacity_df = custom_functions.generate_cluster_capacity_df(*frames)
+        custom_functions.store_cluster_capacity(args.customer, export_date, export_digest, cluster_capacity_df, args.db)
+        print(f"{os.path.basename(file_name)}: {export_date} - {cluster_capacity_df.shape[0]} Cluster gespeichert")
@@ -0,0 +1,342 @@
+import argparse
+import io
+import json
+import os
+import threading
+import time
+import warnings
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs
+import custom_functions
+
+######################
+# RVTools analysis service - JSON results of the overview & sizing calculations via HTTP
+# Usage: python service.py --port 8502
+#   POST /analyze             body: RVTools xlsx export
+#   GET  /analyze?digest=...  analysis of an already parsed export (content digest from a previous response, as long as its frames are kept in memory)
+#   Parameters (query string): cluster (repeatable), growth_vCPU, growth_vRAM, growth_vStorage, option_vCPU, option_vRAM, option_vStorage
+#   GET  /metrics             Prometheus metrics
+#   GET  /health
+#   Limits: --max-concurrent analysis jobs & --max-uploads uploads at the same time (503), --connection-timeout without data (408), --timeout per analysis (504)
+######################
+
+######################
+# Initialize variables
+######################
+warnings.simplefilter("ignore") # Ignore openpyxl Excile File Warning while reading (no default style)
+latency_buckets = (0.05, 0.1, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600)
+endpoints = ('/analyze', '/metrics', '/health')
+result_cache_size = 128
+reject_drain_bytes = 1048576 # bodies of rejected uploads up to this size are read, so the client receives the answer before the connection is closed
+
+######################
+# Service classes
+######################
+# Prometheus style request / latency / throughput metrics
+class ServiceMetrics:
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.requests_total = {}
+        self.latency_bucket_counts = {}
+        self.latency_sum = {}
+        self.latency_count = {}
+        self.rejected_total = {}
+        self.upload_bytes_total = 0
+        self.in_flight = 0
+        self.jobs_running = 0
+        self.jobs_attached = 0
+
+    def observe(self, endpoint, status, duration_seconds):
+        with self.lock:
+            self.requests_total[(endpoint, status)] = self.requests_total.get((endpoint, status), 0) + 1
+            bucket_counts = self.latency_bucket_counts.setdefault(endpoint, [0] * len(latency_buckets))
+            for position, bucket in enumerate(latency_buckets):
+                if duration_seconds <= bucket:
+                    bucket_counts[position] += 1
+            self.latency_sum[endpoint] = self.latency_sum.get(endpoint, 0) + duration_seconds
+            self.latency_count[endpoint] = self.latency_count.get(endpoint, 0) + 1
+
+    def add(self, attribute, value):
+        with self.lock:
+            setattr(self, attribute, getattr(self, attribute) + value)
+
+    def reject(self, reason):
+        with self.lock:
+            self.rejected_total[reason] = self.rejected_total.get(reason, 0) + 1
+
+    def render(self):
+        with self.lock:
+            lines = ['# TYPE rvtools_requests_total counter']
+            lines += [f'rvtools_requests_total{{endpoint="{endpoint}",status="{status}"}} {count}' for (endpoint, status), count in sorted(self.requests_total.items())]
+            lines.append('# TYPE rvtools_request_duration_seconds histogram')
+            for endpoint, bucket_counts in sorted(self.latency_bucket_counts.items()):
+                lines += [f'rvtools_request_duration_seconds_bucket{{endpoint="{endpoint}",le="{bucket:g}"}} {count}' for bucket, count in zip(latency_buckets, bucket_counts)]
+                lines.append(f'rvtools_request_duration_seconds_bucket{{endpoint="{endpoint}",le="+Inf"}} {self.latency_count[endpoint]}')
+                lines.append(f'rvtools_request_duration_seconds_sum{{endpoint="{endpoint}"}} {self.latency_sum[endpoint]:.6f}')
+                lines.append(f'rvtools_request_duration_seconds_count{{endpoint="{endpoint}"}} {self.latency_count[endpoint]}')
+            lines.append('# TYPE rvtools_rejected_requests_total counter')
+            lines += [f'rvtools_rejected_requests_total{{reason="{reason}"}} {count}' for reason, count in sorted(self.rejected_total.items())]
+            lines.append('# TYPE rvtools_upload_bytes_total counter')
+            lines.append(f'rvtools_upload_bytes_total {self.upload_bytes_total}')
+            lines.append('# TYPE rvtools_requests_in_flight gauge')
+            lines.append(f'rvtools_requests_in_flight {self.in_flight}')
+            lines.append('# TYPE rvtools_analysis_jobs_running gauge')
+            lines.append(f'rvtools_analysis_jobs_running {self.jobs_running}')
+            lines.append('# TYPE rvtools_analysis_jobs_attached_total counter')
+            lines.append(f'rvtools_analysis_jobs_attached_total {self.jobs_attached}')
+
+        return '\n'.join(lines) + '\n'
+
+# Request body as file object - reads at most Content-Length bytes from the connection
+class RequestBodyFile(io.RawIOBase):
+
+    def __init__(self, rfile, content_length):
+        self.rfile = rfile
+        self.remaining = content_length
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        data = self.rfile.read(min(len(buffer), self.remaining))
+        buffer[:len(data)] = data
+        self.remaining -= len(data)
+        return len(data)
+
+# HTTP request handler - configuration & shared objects are attributes of the server
+class AnalysisRequestHandler(BaseHTTPRequestHandler):
+
+    timeout = 60 # socket timeout (s) for request line, headers & body - replaced by the connection timeout of the server in setup()
+
+    def setup(self):
+        self.timeout = self.server.connection_timeout
+        super().setup()
+
+    def send_json(self, status, payload):
+        body = json.dumps(payload).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+        return status
+
+    def send_text(self, status, text):
+        body = text.encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+        return status
+
+    # Answer without reading the whole body - small bodies are discarded first, otherwise the connection is closed
+    def reject_upload(self, status, reason, payload, content_length):
+        self.server.metrics.reject(reason)
+        if content_length <= reject_drain_bytes:
+            self.rfile.read(content_length)
+        self.close_connection = True
+        return self.send_json(status, payload)
+
+    def handle_request(self, method):
+        start_time = time.monotonic()
+        request_url = urlparse(self.path)
+        endpoint = request_url.path if request_url.path in endpoints else 'other'
+        self.server.metrics.add('in_flight', 1)
+        status = 500
+        try:
+            if endpoint == '/health' and method == 'GET':
+                status = self.send_json(200, {'status': 'ok'})
+            elif endpoint == '/metrics' and method == 'GET':
+                status = self.send_text(200, self.server.metrics.render())
+            elif endpoint == '/analyze' and method in ('GET', 'POST'):
+                status = self.handle_analyze(method, parse_qs(request_url.query))
+            else:
+                status = self.send_json(404, {'error': 'Not found'})
+        except Exception as e:
+            status = self.send_json(500, {'error': str(e)})
+        finally:
+            self.server.metrics.add('in_flight', -1)
+            self.server.metrics.observe(endpoint, status, time.monotonic() - start_time)
+
+    def do_GET(self):
+        self.handle_request('GET')
+
+    def do_POST(self):
+        self.handle_request('POST')
+
+    def handle_analyze(self, method, query):
+        vCluster_selected = [cluster for value in query.get('cluster', []) for cluster in value.split(',') if cluster]
+        try:
+            sizing_growth = {sizing_type: int(query['growth_'+sizing_type][0]) for sizing_type in custom_functions.sizing_options if 'growth_'+sizing_type in query}
+        except ValueError:
+            return self.send_json(400, {'error': 'growth_* parameters have to be integer percentages'})
+        sizing_selected = {sizing_type: query['option_'+sizing_type][0] for sizing_type in custom_functions.sizing_options if 'option_'+sizing_type in query}
+        for sizing_type, sizing_option in sizing_selected.items():
+            if sizing_option not in custom_functions.sizing_options[sizing_type]:
+                return self.send_json(400, {'error': 'Unknown option_'+sizing_type, 'options': list(custom_functions.sizing_options[sizing_type])})
+
+        spooled_path = None
+        if method == 'POST':
+            try:
+                content_length = int(self.headers.get('Content-Length', 0))
+            except ValueError:
+                return self.send_json(400, {'error': 'Invalid Content-Length header'})
+            if content_length <= 0:
+                return self.send_json(411, {'error': 'Content-Length with RVTools xlsx export required'})
+            if content_length > self.server.max_upload_bytes:
+                return self.reject_upload(413, 'upload_too_large', {'error': 'Upload larger than '+str(self.server.max_upload_bytes)+' bytes'}, content_length)
+            # admission before the upload is spooled - busy service does not read the body
+            if not self.server.accepts_jobs():
+                return self.reject_upload(503, 'busy', {'error': 'Service busy, retry later'}, content_length)
+            if not self.server.upload_slots.acquire(blocking=False):
+                return self.reject_upload(503, 'uploads_busy', {'error': 'Too many uploads, retry later'}, content_length)
+            try:
+                spooled_path = custom_functions.spool_uploaded_file(RequestBodyFile(self.rfile, content_length))
+                spooled_size = os.path.getsize(spooled_path)
+                self.server.metrics.add('upload_bytes_total', spooled_size)
+                if spooled_size < content_length:
+                    os.remove(spooled_path)
+                    self.close_connection = True
+                    return self.send_json(400, {'error': 'Upload incomplete, '+str(spooled_size)+' of '+str(content_length)+' bytes received'})
+                with open(spooled_path, 'rb') as spooled_file:
+                    digest = custom_functions.calculate_upload_digest(spooled_file)
+            except TimeoutError:
+                # partial upload is removed by spool_uploaded_file
+                self.server.metrics.reject('upload_timeout')
+                self.close_connection = True
+                return self.send_json(408, {'error': 'Upload timed out after '+str(self.server.connection_timeout)+' s without data'})
+            finally:
+                self.server.upload_slots.release()
+        else:
+            digest = query.get('digest', [''])[0]
+            if not digest:
+                return self.send_json(400, {'error': 'digest parameter required, upload the RVTools export via POST /analyze'})
+
+        submitted = False
+        try:
+            future, submitted = self.get_analysis_future(spooled_path, digest, vCluster_selected, sizing_growth, sizing_selected)
+        finally:
+            if spooled_path is not None and not submitted: # otherwise removed once the job is done
+                os.remove(spooled_path)
+        if future is None:
+            self.server.metrics.reject('busy')
+            return self.send_json(503, {'error': 'Service busy, retry later', 'digest': digest})
+
+        try:
+            analysis_result = future.result(timeout=self.server.request_timeout)
+        except FutureTimeoutError:
+            # job keeps running, its result is cached and a retry attaches to it
+            self.server.metrics.reject('timeout')
+            return self.send_json(504, {'error': 'Analysis timed out after '+str(self.server.request_timeout)+' s, retry later', 'digest': digest})
+        except custom_functions.RVToolsValidationError as e:
+            return self.send_json(422, {'error': str(e), 'digest': digest})
+        except custom_functions.UnknownClusterError as e:
+            return self.send_json(400, {'error': str(e), 'clusters': e.clusters, 'digest': digest})
+        except custom_functions.ParseQueueFullError:
+            self.server.metrics.reject('parse_queue_full')
+            return self.send_json(503, {'error': 'Service busy, retry later', 'digest': digest})
+        except custom_functions.AnalysisFramesNotStoredError:
+            return self.send_json(404, {'error': 'Unknown digest, upload the RVTools export via POST /analyze'})
+
+        return self.send_json(200, analysis_result)
+
+    # Cached result, running job for the same request or a new job (None if too many jobs are running) - True if a new job was submitted
+    def get_analysis_future(self, spooled_path, digest, vCluster_selected, sizing_growth, sizing_selected):
+        server = self.server
+        cache_key = json.dumps([digest, sorted(vCluster_selected), sizing_growth, sizing_selected], sort_keys=True)
+        with server.jobs_lock:
+            if cache_key in server.result_cache:
+                server.result_cache.move_to_end(cache_key)
+                future = Future()
+                future.set_result(server.result_cache[cache_key])
+                return future, False
+            if cache_key in server.jobs_in_flight:
+                server.metrics.add('jobs_attached', 1)
+                return server.jobs_in_flight[cache_key], False
+            if len(server.jobs_in_flight) >= server.max_concurrent:
+                return None, False
+            future = server.executor.submit(custom_functions.run_analysis_job, spooled_path, digest, vCluster_selected, sizing_growth, sizing_selected)
+            server.jobs_in_flight[cache_key] = future
+            server.spooled_paths_in_use[cache_key] = spooled_path
+        server.metrics.add('jobs_running', 1)
+        future.add_done_callback(lambda future: server.finish_analysis_job(cache_key, future))
+
+        return future, True
+
+    def log_message(self, format, *args):
+        if not self.server.quiet:
+            super().log_message(format, *args)
+
+######################
+# Service start
+######################
+# Analysis jobs wait for the shared parse scheduler (custom_functions) and calculate the results, finished results are cached per request
+class AnalysisServer(ThreadingHTTPServer):
+
+    daemon_threads = True
+
+    def __init__(self, server_address, max_concurrent, request_timeout, max_upload_mib, quiet=False, max_uploads=None, connection_timeout=AnalysisRequestHandler.timeout):
+        super().__init__(server_address, AnalysisRequestHandler)
+        self.executor = ThreadPoolExecutor(max_workers=max_concurrent)
+        self.max_concurrent = max_concurrent
+        self.request_timeout = request_timeout
+        self.max_upload_bytes = int(max_upload_mib * 1048576)
+        self.upload_slots = threading.BoundedSemaphore(max_uploads or max_concurrent) # uploads spooled at the same time (503 if exceeded)
+        self.connection_timeout = connection_timeout
+        self.jobs_lock = threading.Lock()
+        self.jobs_in_flight = {} # cache key -> future of the running analysis job
+        self.spooled_paths_in_use = {} # cache key -> spooled upload of the running analysis job (removed once the job is done)
+        self.result_cache = OrderedDict()
+        self.metrics = ServiceMetrics()
+        self.quiet = quiet
+
+    # Free slot for a new analysis job (a request for a running or cached job is answered anyway)
+    def accepts_jobs(self):
+        with self.jobs_lock:
+            return len(self.jobs_in_flight) < self.max_concurrent
+
+    # Done callback - results of jobs are cached even if the request already timed out
+    def finish_analysis_job(self, cache_key, future):
+        with self.jobs_lock:
+            del self.jobs_in_flight[cache_key]
+            spooled_path = self.spooled_paths_in_use.pop(cache_key)
+            if not future.cancelled() and future.exception() is None:
+                self.result_cache[cache_key] = future.result()
+                while len(self.result_cache) > result_cache_size:
+                    self.result_cache.popitem(last=False)
+        self.metrics.add('jobs_running', -1)
+        if spooled_path is not None:
+            try:
+                os.remove(spooled_path)
+            except FileNotFoundError:
+                pass
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='RVTools analysis HTTP service.')
+    parser.add_argument('--host', default='127.0.0.1', help='Bind address (default: local only)')
+    parser.add_argument('--port', type=int, default=8502)
+    parser.add_argument('--workers', type=int, default=custom_functions.parse_worker_amount, help='Worker processes of the parse scheduler')
+    parser.add_argument('--max-concurrent', type=int, default=4, help='Analysis jobs running at the same time (503 if exceeded)')
+    parser.add_argument('--timeout', type=float, default=600, help='Seconds until an analysis request is answered with 504 (job keeps running)')
+    parser.add_argument('--max-uploads', type=int, default=None, help='Uploads spooled at the same time (503 if exceeded, default: --max-concurrent)')
+    parser.add_argument('--connection-timeout', type=float, default=AnalysisRequestHandler.timeout, help='Seconds without data until a connection is closed (408 during an upload)')
+    parser.add_argument('--max-upload-mib', type=float, default=500)
+    parser.add_argument('--quiet', action='store_true')
+    args = parser.parse_args()
+
+    custom_functions.parse_worker_amount = args.workers # read when the parse worker pool is created
+    server = AnalysisServer((args.host, args.port), args.max_concurrent, args.timeout, args.max_upload_mib, args.quiet, args.max_uploads, args.connection_timeout)
+    print(f"RVTools analysis service listening on http://{args.host}:{args.port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        server.executor.shutdown(wait=False, cancel_futures=True)
+        if custom_functions.parse_executor is not None:
+            custom_functions.parse_executor.shutdown(cancel_futures=True)
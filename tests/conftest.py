@@ -0,0 +1,7 @@
+import os
+import sys
+
+# custom_functions loads images/ relative to the working directory - tests run from the repo root
+repo_directory = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, repo_directory)
+os.chdir(repo_directory)
@@ -0,0 +1,134 @@
+import http.client
+import json
+import threading
+import time
+import pytest
+import xlsxwriter
+import custom_functions
+import service
+
+# Minimal RVTools export: two clusters with one host each, one VM per cluster
+rvtools_sheets = {
+    'vInfo': (custom_functions.vInfo_cols_to_use, [
+        ['vm1', 'poweredOn', 2, 4096, 51200, 20480, 'DC1', 'C1', 'h1', 'Microsoft Windows Server 2019 (64-bit)', 'Microsoft Windows Server 2019 (64-bit)', 'vm-1'],
+        ['vm2', 'poweredOff', 4, 8192, 102400, 40960, 'DC1', 'C2', 'h2', 'Red Hat Enterprise Linux 8 (64-bit)', None, 'vm-2'],
+    ]),
+    'vCPU': (custom_functions.vCPU_cols_to_use, [['vm1', 'poweredOn', 2, 'C1', 'vm-1'], ['vm2', 'poweredOff', 4, 'C2', 'vm-2']]),
+    'vMemory': (custom_functions.vMemory_cols_to_use, [['vm1', 'poweredOn', 4096, 'C1', 'vm-1'], ['vm2', 'poweredOff', 8192, 'C2', 'vm-2']]),
+    'vDisk': (custom_functions.vDisk_cols_to_use, [['poweredOn', 51200, True, 'C1', 'vm-1'], ['poweredOff', 102400, False, 'C2', 'vm-2']]),
+    'vPartition': (custom_functions.vPartition_cols_to_use, [['poweredOn', 40960, 10240, 'C1', 'vm-1']]),
+    'vHost': (custom_functions.vHosts_cols_to_use, [['h1', 'C1', 2400, 2, 16, 32, 30, 524288, 50, 1], ['h2', 'C2', 2400, 2, 16, 32, 20, 524288, 40, 1]]),
+    'vDatastore': (custom_functions.vDatastore_cols_to_use + ['Hosts'], [[1048576, 524288, 262144, 'ds-1', 'h1'], [2097152, 1048576, 524288, 'ds-2', 'h2']]),
+}
+
+@pytest.fixture(scope='module')
+def rvtools_export(tmp_path_factory):
+    export_path = tmp_path_factory.mktemp('export') / 'rvtools.xlsx'
+    workbook = xlsxwriter.Workbook(str(export_path))
+    for sheet_name, (header, rows) in rvtools_sheets.items():
+        worksheet = workbook.add_worksheet(sheet_name)
+        worksheet.write_row(0, 0, header)
+        for row_number, row in enumerate(rows, start=1):
+            worksheet.write_row(row_number, 0, row)
+    workbook.close()
+
+    return export_path.read_bytes()
+
+@pytest.fixture
+def start_server():
+    servers = []
+
+    def start(max_concurrent=2, request_timeout=60, max_upload_mib=10):
+        server = service.AnalysisServer(('127.0.0.1', 0), max_concurrent, request_timeout, max_upload_mib, quiet=True)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        servers.append(server)
+        return server
+
+    yield start
+    for server in servers:
+        server.shutdown()
+        server.server_close()
+        server.executor.shutdown(wait=False, cancel_futures=True)
+
+def request(server, method, path, body=None):
+    connection = http.client.HTTPConnection(*server.server_address, timeout=60)
+    try:
+        connection.request(method, path, body=body)
+        response = connection.getresponse()
+        payload = response.read()
+    finally:
+        connection.close()
+    if response.getheader('Content-Type') == 'application/json':
+        payload = json.loads(payload)
+
+    return response.status, payload
+
+def test_analyze_upload_and_digest(start_server, rvtools_export):
+    server = start_server()
+
+    status, analysis_result = request(server, 'POST', '/analyze?cluster=C1', rvtools_export)
+    assert status == 200
+    assert analysis_result['clusters'] == ['C1', 'C2']
+    assert analysis_result['clusters_selected'] == ['C1']
+
+    status, analysis_result = request(server, 'GET', '/analyze?digest='+analysis_result['digest'])
+    assert status == 200
+    assert analysis_result['clusters_selected'] == ['C1', 'C2']
+
+def test_analyze_invalid_parameters(start_server, rvtools_export):
+    server = start_server()
+
+    status, payload = request(server, 'POST', '/analyze?cluster=C9', rvtools_export)
+    assert status == 400
+    assert payload['clusters'] == ['C1', 'C2']
+    assert request(server, 'GET', '/analyze?digest='+payload['digest']+'&growth_vCPU=viel')[0] == 400
+    assert request(server, 'GET', '/analyze')[0] == 400
+
+def test_analyze_unknown_digest_and_endpoint(start_server):
+    server = start_server()
+
+    assert request(server, 'GET', '/analyze?digest='+'0' * 64)[0] == 404
+    assert request(server, 'GET', '/unknown')[0] == 404
+
+def test_analyze_unreadable_upload(start_server):
+    server = start_server()
+
+    status, payload = request(server, 'POST', '/analyze', b'notazip')
+    assert status == 422
+    assert 'digest' in payload
+
+def test_analyze_timeout_and_busy(start_server, monkeypatch):
+    job_release = threading.Event()
+    def blocked_analysis_job(spooled_path, upload_digest, *args):
+        job_release.wait(60)
+        return {'digest': upload_digest}
+    monkeypatch.setattr(custom_functions, 'run_analysis_job', blocked_analysis_job)
+    server = start_server(max_concurrent=1, request_timeout=0.2)
+
+    # job keeps running after the 504 and occupies the only slot - a new upload is not admitted
+    status, payload = request(server, 'POST', '/analyze', b'first upload')
+    assert status == 504
+    assert request(server, 'POST', '/analyze', b'second upload')[0] == 503
+
+    running_job = next(iter(server.jobs_in_flight.values()))
+    job_release.set()
+    running_job.result(timeout=60)
+    assert request(server, 'POST', '/analyze', b'first upload') == (200, {'digest': payload['digest']})
+
+def test_metrics(start_server):
+    server = start_server()
+    request(server, 'GET', '/health')
+    request(server, 'GET', '/analyze?digest='+'0' * 64)
+
+    # requests are observed after their answer is sent
+    for attempt in range(50):
+        status, metrics = request(server, 'GET', '/metrics')
+        metrics = metrics.decode('utf-8')
+        if 'endpoint="/analyze",status="404"' in metrics:
+            break
+        time.sleep(0.1)
+    assert status == 200
+    assert 'rvtools_requests_total{endpoint="/health",status="200"} 1' in metrics
+    assert 'rvtools_requests_total{endpoint="/analyze",status="404"} 1' in metrics
+    assert 'rvtools_request_duration_seconds_count{endpoint="/analyze"} 1' in metrics
+    assert 'rvtools_requests_in_flight 1' in metrics
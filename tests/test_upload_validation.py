@@ -0,0 +1,28 @@
+import io
+import pytest
+import custom_functions
+
+# Uploads that are no xlsx file - short bodies end up in zipfile's end of archive probe, empty files can not be memory mapped
+unreadable_uploads = [b'', b'notazip', b'x' * 21, b'x' * 5000]
+
+@pytest.mark.parametrize('body', unreadable_uploads)
+def test_validate_spooled_upload_rejects_unreadable_file(tmp_path, body):
+    spooled_path = tmp_path / 'upload.xlsx'
+    spooled_path.write_bytes(body)
+
+    with pytest.raises(custom_functions.RVToolsValidationError):
+        with custom_functions.open_mapped_file(str(spooled_path)) as mapped_file:
+            custom_functions.validate_rvtools_workbook(mapped_file)
+
+@pytest.mark.parametrize('body', unreadable_uploads)
+def test_load_analysis_frames_rejects_unreadable_upload(body):
+    with pytest.raises(custom_functions.RVToolsValidationError):
+        custom_functions.load_analysis_frames(io.BytesIO(body), 'test-session')
+
+def test_mapped_file_seek_out_of_range_raises_oserror(tmp_path):
+    spooled_path = tmp_path / 'upload.xlsx'
+    spooled_path.write_bytes(b'notazip')
+
+    with custom_functions.open_mapped_file(str(spooled_path)) as mapped_file:
+        with pytest.raises(OSError):
+            mapped_file.seek(-22, io.SEEK_END)